@@ -0,0 +1,203 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+def query_numbers(query):
+    # "revenue in 2022" and "revenue in 2023" embed almost identically
+    return sorted(NUMBER_PATTERN.findall(query))
+
+
+class SemanticAnswerCache:
+    """
+    Cache of generated answers looked up by query embedding similarity.
+
+    A query whose cosine similarity with a previously answered query reaches
+    similarity_threshold, and which mentions the same numbers, gets the stored
+    answer back. Entries expire after
+    ttl_seconds and the least recently used ones are dropped beyond
+    max_entries. Every entry belongs to a context (model, dataset, index):
+    setting a different context empties the cache, since its answers may no
+    longer be what the new engine would produce.
+
+    Args:
+        embed_query: function returning the embedding of a query string.
+        persist_path: JSON file the cache is saved to, save_delay seconds
+            after a change so that consecutive changes are written once.
+    """
+
+    def __init__(self, embed_query, persist_path, similarity_threshold=0.97, max_entries=500, ttl_seconds=86400,
+                 save_delay=5):
+        self.embed_query = embed_query
+        self.persist_path = persist_path
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.save_delay = save_delay
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._save_timer = None
+        self._context = None
+        self._entries = []
+        self._embeddings = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, 'r') as file:
+                data = json.load(file)
+            self._context = data["context"]
+            self._entries = data["entries"]
+        except Exception as e:
+            print(f"Ignoring answer cache {self.persist_path}: {e}")
+            self._entries = []
+        self._update_embeddings()
+
+    def _save(self):
+        # called with the lock held, the file is written later by flush
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.save_delay, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def flush(self):
+        """Write the pending changes to persist_path."""
+        with self._save_lock:
+            with self._lock:
+                if self._save_timer is None:
+                    return
+                self._save_timer.cancel()
+                self._save_timer = None
+                data = {"context": self._context, "entries": list(self._entries)}
+            os.makedirs(os.path.dirname(self.persist_path), exist_ok=True)
+            tmp_path = self.persist_path + ".tmp"
+            with open(tmp_path, 'w') as file:
+                json.dump(data, file)
+            os.replace(tmp_path, self.persist_path)
+
+    def _update_embeddings(self):
+        if len(self._entries) == 0:
+            self._embeddings = None
+        else:
+            self._embeddings = np.array([entry["embedding"] for entry in self._entries], dtype="float32")
+
+    def _normalized_embedding(self, query):
+        embedding = np.asarray(self.embed_query(query), dtype="float32")
+        return embedding / max(np.linalg.norm(embedding), 1e-12)
+
+    def set_context(self, context):
+        with self._lock:
+            if context == self._context:
+                return
+            if len(self._entries) > 0:
+                print("Invalidating the answer cache")
+            self._context = context
+            self._entries = []
+            self._update_embeddings()
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+            self._update_embeddings()
+            self._save()
+
+    def invalidate(self, is_stale):
+        """
+        Drop the entries for which is_stale(answer) is True.
+
+        Returns:
+            the number of dropped entries.
+        """
+        with self._lock:
+            entries = [entry for entry in self._entries if not is_stale(entry["answer"])]
+            dropped = len(self._entries) - len(entries)
+            if dropped > 0:
+                self._entries = entries
+                self._update_embeddings()
+                self._save()
+            return dropped
+
+    def lookup(self, query):
+        """
+        Returns:
+            the cached answer of the most similar query, or None.
+        """
+        embedding = self._normalized_embedding(query)
+        numbers = query_numbers(query)
+        with self._lock:
+            self._expire()
+            if self._embeddings is None:
+                return None
+            similarities = self._embeddings @ embedding
+            for index in np.argsort(-similarities):
+                if similarities[index] < self.similarity_threshold:
+                    return None
+                entry = self._entries[int(index)]
+                if query_numbers(entry["query"]) == numbers:
+                    entry["last_used"] = time.time()
+                    return entry["answer"]
+            return None
+
+    def store(self, query, answer):
+        embedding = self._normalized_embedding(query)
+        now = time.time()
+        with self._lock:
+            self._entries.append({
+                "query": query,
+                "answer": answer,
+                "embedding": embedding.tolist(),
+                "created": now,
+                "last_used": now
+            })
+            if len(self._entries) > self.max_entries:
+                self._entries.sort(key=lambda entry: entry["last_used"])
+                self._entries = self._entries[-self.max_entries:]
+            self._update_embeddings()
+            self._save()
+
+    def _expire(self):
+        if self.ttl_seconds <= 0:
+            return
+        deadline = time.time() - self.ttl_seconds
+        entries = [entry for entry in self._entries if entry["created"] >= deadline]
+        if len(entries) != len(self._entries):
+            self._entries = entries
+            self._update_embeddings()
+            self._save()
+
+
+def replay_answer(answer, words_per_chunk=8):
+    """Yield a cached answer progressively, the way streamed answers are yielded."""
+    words = answer.split(" ")
+    for end in range(words_per_chunk, len(words), words_per_chunk):
+        yield " ".join(words[:end])
+    yield answer
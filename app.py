@@ -19,8 +19,10 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 import argparse
+import asyncio
+import inspect
 import os
-import time
+import threading
 import json
 import logging
 import gc
@@ -31,17 +33,48 @@ from langchain.embeddings.huggingface import HuggingFaceEmbeddings
 from collections import defaultdict
 from llama_index import ServiceContext
 from llama_index import set_global_service_context
-from llama_index.core.response.schema import RESPONSE_TYPE
+from llama_index import QueryBundle
+from llama_index import PromptHelper
+from llama_index.core.response.schema import RESPONSE_TYPE, Response
+from llama_index.schema import MetadataMode
+from llama_index.node_parser import SentenceSplitter
+from llama_index.prompts import PromptTemplate
 #from llama_index.llms import OpenAI
 
 from faiss_vector_storage import FaissEmbeddingStorage
+from document_loader import ParallelDocumentLoader, chunk_id
+from embedding_engine import EmbeddingEngine
+from embedding_cache import EmbeddingCache
+from faiss_index_factory import FaissIndexOptions
+from bm25_index import HybridSearchOptions
+from reranker import CrossEncoderReranker
+from node_postprocessors import AdaptiveTopKPostprocessor
+from answer_cache import SemanticAnswerCache, replay_answer
+from chat_session_pool import ChatSessionPool
+from index_cache import IndexCache
+from dataset_watcher import DatasetWatcher
+from index_builder import BackgroundIndexBuilder, build_in_staging, index_exists, promote_staged_index
+from stream_coalescer import StreamCoalescer
 from ui.user_interface import MainInterface
-from llama_index.llms.ollama import Ollama
+from ollama_llm import AsyncOllama, OllamaConversation
 
 app_config_file = 'config/app_config.json'
 model_config_file = 'config/config.json'
 preference_config_file = 'config/preferences.json'
 data_source = 'directory'
+# introduces the dataset files an answer is based on
+REFERENCE_FILES_TITLE = "Reference files:"
+# RAG prompt of conversations reusing their Ollama context: the previous turns
+# come first as context tokens, then only the new context and question
+CONVERSATION_QA_PROMPT = PromptTemplate(
+    "Context information is below.\n"
+    "---------------------\n"
+    "{context_str}\n"
+    "---------------------\n"
+    "Given the context information and the conversation so far, answer the query.\n"
+    "Query: {query_str}\n"
+    "Answer: "
+)
 
 def read_config(file_name):
     try:
@@ -61,7 +94,8 @@ def get_model_config(config, model_name=None):
     return {
         "max_new_tokens": selected_model["metadata"]["max_new_tokens"],
         "max_input_token": selected_model["metadata"]["max_input_token"],
-        "temperature": selected_model["metadata"]["temperature"]
+        "temperature": selected_model["metadata"]["temperature"],
+        "keep_alive": selected_model["metadata"].get("keep_alive")
     }
 
 def get_data_path(config):
@@ -85,7 +119,27 @@ similarity_top_k = app_config["similarity_top_k"]
 is_chat_engine = app_config["is_chat_engine"]
 embedded_model = app_config["embedded_model"]
 embedded_dimension = app_config["embedded_dimension"]
+embedded_batch_size = app_config["embedded_batch_size"]
+embedding_cache_config = app_config["embedding_cache"]
 score_threshold_filter = app_config["score_threshold_filter"]
+ingestion_config = app_config["ingestion"]
+faiss_index_options = FaissIndexOptions.from_config(app_config["faiss_index"])
+docstore_backend = app_config["docstore"]
+hybrid_search_options = HybridSearchOptions.from_config(app_config["hybrid_search"])
+rerank_config = app_config["rerank"]
+context_packing_config = app_config["context_packing"]
+adaptive_top_k_config = app_config["adaptive_top_k"]
+context_compression_config = app_config["context_compression"]
+answer_cache_config = app_config["answer_cache"]
+stream_coalescing_config = app_config["stream_coalescing"]
+stream_deltas = app_config["stream_deltas"]
+async_pipeline = app_config["async_pipeline"]
+concurrency_limit = app_config["concurrency_limit"]
+chat_sessions_config = app_config["chat_sessions"]
+index_cache_config = app_config["index_cache"]
+prompt_prefix_config = app_config["prompt_prefix_reuse"]
+warm_up_config = app_config["warm_up"]
+dataset_watcher_config = app_config["dataset_watcher"]
 
 # read model specific config
 selected_model_name = None
@@ -102,7 +156,9 @@ if selected_model_name == None:
 model_config = get_model_config(config, selected_model_name)
 data_dir = config["dataset"]["path"] if selected_data_directory == None else selected_data_directory
 
-llm = Ollama(model=selected_model_name, base_url=base_url)
+# the context window is sent as num_ctx, Ollama's default may be smaller
+llm = AsyncOllama(model=selected_model_name, base_url=base_url, keep_alive=model_config["keep_alive"],
+                  context_window=model_config["max_input_token"])
 
 #for tests
 #from dotenv import load_dotenv
@@ -112,45 +168,274 @@ llm = Ollama(model=selected_model_name, base_url=base_url)
 # create embeddings model object
 embed_model = HuggingFaceEmbeddings(model_name=embedded_model)
 service_context = ServiceContext.from_defaults(llm=llm, embed_model=embed_model,
-                                               context_window=model_config["max_input_token"], chunk_size=512,
-                                               chunk_overlap=200)
+                                               context_window=model_config["max_input_token"],
+                                               node_parser=SentenceSplitter(chunk_size=512, chunk_overlap=200,
+                                                                            id_func=chunk_id))
 set_global_service_context(service_context)
 
+# parses dataset files in worker processes, 0 workers means one per CPU core
+document_loader = ParallelDocumentLoader(workers=ingestion_config["workers"],
+                                         max_file_size_mb=ingestion_config["max_file_size_mb"],
+                                         file_timeout=ingestion_config["file_timeout_seconds"])
+# embeds the chunks of index builds in length-sorted batches
+embedding_engine = EmbeddingEngine(embed_model, batch_size=embedded_batch_size)
+# rescores retrieved chunks against the question before they reach the prompt
+reranker = None
+if rerank_config["enabled"]:
+    reranker = CrossEncoderReranker(model_name=rerank_config["model"], cache_size=rerank_config["cache_size"])
+# number of chunks sent to the LLM chosen per question from their scores
+adaptive_top_k = None
+if adaptive_top_k_config["enabled"]:
+    adaptive_top_k = AdaptiveTopKPostprocessor(min_k=adaptive_top_k_config["min_k"],
+                                               max_k=adaptive_top_k_config["max_k"],
+                                               max_score=adaptive_top_k_config["max_score"],
+                                               min_gap=adaptive_top_k_config["min_gap"])
+# chunk embeddings shared by every dataset and rebuild, keyed by model and text hash
+embedding_cache = None
+if embedding_cache_config["enabled"]:
+    embedding_cache = EmbeddingCache(cache_dir=os.path.join(os.getcwd(), embedding_cache_config["path"]),
+                                     model_name=embedded_model, dimension=embedded_dimension,
+                                     max_size_mb=embedding_cache_config["max_size_mb"])
+# answers replayed for questions close enough to an already answered one
+answer_cache = None
+if answer_cache_config["enabled"]:
+    answer_cache = SemanticAnswerCache(embed_query=embed_model.embed_query,
+                                       persist_path=os.path.join(os.getcwd(), answer_cache_config["path"]),
+                                       similarity_threshold=answer_cache_config["similarity_threshold"],
+                                       max_entries=answer_cache_config["max_entries"],
+                                       ttl_seconds=answer_cache_config["ttl_seconds"],
+                                       save_delay=answer_cache_config["save_delay_seconds"])
+# bounds how often streamed answers are pushed to the UI
+stream_coalescer = StreamCoalescer(interval_ms=stream_coalescing_config["interval_ms"],
+                                   max_chars=stream_coalescing_config["max_chars"])
+# builds indexes in the background while the current engine keeps answering
+index_builder = BackgroundIndexBuilder()
+# storage and engine answering the questions, replaced by swap_inferance_engine
+faiss_storage = None
+engine = None
+
+# indexes of recently used datasets kept loaded for fast switching
+index_cache = IndexCache(max_memory_mb=index_cache_config["max_memory_mb"])
+# one chat engine, hence one conversation memory, per browser session
+chat_sessions = ChatSessionPool(
+    engine_factory=lambda: faiss_storage.get_engine(is_chat_engine=True, streaming=streaming,
+                                                    similarity_top_k=similarity_top_k,
+                                                    service_context=service_context),
+    max_sessions=chat_sessions_config["max_sessions"],
+    idle_timeout=chat_sessions_config["idle_timeout_seconds"])
+# Ollama context of each conversation, sent back as prompt prefix of its next
+# question; the chat engine keeps its own conversation memory instead
+conversations = None
+if prompt_prefix_config["enabled"] and not is_chat_engine:
+    conversations = ChatSessionPool(
+        engine_factory=lambda: OllamaConversation(
+            max_tokens=int(model_config["max_input_token"] * prompt_prefix_config["max_history_ratio"])),
+        max_sessions=chat_sessions_config["max_sessions"],
+        idle_timeout=chat_sessions_config["idle_timeout_seconds"])
+
+
+def update_answer_cache_context(clear=False):
+    # cached answers are only valid for the model and dataset that produced them
+    if answer_cache is None:
+        return
+    if clear:
+        answer_cache.clear()
+    dataset = os.path.abspath(data_dir) if data_source == "directory" else ""
+    answer_cache.set_context(f"{llm.model}|{data_source}|{dataset}")
+
+
+def create_faiss_storage(data, persist_dir=None):
+    return FaissEmbeddingStorage(data_dir=data,
+                                 dimension=embedded_dimension,
+                                 document_loader=document_loader,
+                                 embedding_engine=embedding_engine,
+                                 embedding_cache=embedding_cache,
+                                 index_options=faiss_index_options,
+                                 docstore_backend=docstore_backend,
+                                 persist_dir=persist_dir,
+                                 progress_callback=index_builder.report,
+                                 hybrid_options=hybrid_search_options,
+                                 reranker=reranker,
+                                 rerank_candidates=rerank_config["candidates"],
+                                 context_reserved_tokens=context_packing_config["reserved_tokens"]
+                                 if context_packing_config["enabled"] else None,
+                                 adaptive_top_k=adaptive_top_k,
+                                 compression_ratio=context_compression_config["ratio"]
+                                 if context_compression_config["enabled"] else None)
+
+
+def load_faiss_storage(data, force_rewrite=False):
+    persist_dir = FaissEmbeddingStorage.default_persist_dir(data)
+    try:
+        # a build that could not replace the index while it was in use
+        promote_staged_index(persist_dir)
+    except OSError as e:
+        print(f"Unable to replace {persist_dir} with its staged build: {e}")
+    if force_rewrite or not index_exists(persist_dir):
+        # indexes are written next to the one being served and swapped in once complete
+        return build_in_staging(lambda staging_dir: create_faiss_storage(data, staging_dir), persist_dir,
+                                force_rewrite=force_rewrite)
+    storage = create_faiss_storage(data)
+    storage.initialize_index()
+    refresh_faiss_storage(storage)
+    return storage
+
+
+def refresh_faiss_storage(storage):
+    """Apply to the index the dataset changes made while it was not watched."""
+    if not storage.manifest.exists():
+        return
+    changed_files = storage.update_index()
+    if len(changed_files) > 0:
+        index_cache.update(storage.data_dir)
+        invalidate_cached_answers(changed_files)
+
+
+def swap_inferance_engine(storage):
+    # queries in flight keep the engine they started with; a single assignment
+    # publishes the new storage and engine together
+    global engine, faiss_storage
+    new_engine = storage.get_engine(is_chat_engine=is_chat_engine, streaming=streaming,
+                                    similarity_top_k=similarity_top_k, service_context=service_context)
+    faiss_storage, engine = storage, new_engine
+    # the memory estimate was taken while the index was staged
+    index_cache.update(storage.data_dir)
+    # conversations were held by engines of the previous index
+    chat_sessions.clear()
+    if conversations is not None:
+        # their contexts hold chunks of the previous index
+        conversations.clear()
+    print(f"Serving the index of {storage.data_dir}")
+
 
 def generate_inferance_engine(data, force_rewrite=False):
     """
-       Initialize and return a FAISS-based inference engine.
+       Initialize the FAISS-based inference engine and make it the one answering.
 
        Args:
            data: The directory where the data for the inference engine is located.
            force_rewrite (bool): If True, force rewriting the index.
 
-       Returns:
-           The initialized inference engine.
-
        Raises:
            RuntimeError: If unable to generate the inference engine.
        """
     try:
-        global engine
-        faiss_storage = FaissEmbeddingStorage(data_dir=data,
-                                              dimension=embedded_dimension)
-        faiss_storage.initialize_index(force_rewrite=force_rewrite)
-        engine = faiss_storage.get_engine(is_chat_engine=is_chat_engine, streaming=streaming,
-                                          similarity_top_k=similarity_top_k)
+        if force_rewrite:
+            index_cache.discard(data)
+        # the dataset may have changed since a cached index was last served
+        storage = index_cache.get(data, lambda: load_faiss_storage(data, force_rewrite),
+                                  refresh=refresh_faiss_storage)
+        swap_inferance_engine(storage)
+        update_answer_cache_context(clear=force_rewrite)
     except Exception as e:
         raise RuntimeError(f"Unable to generate the inference engine: {e}")
 
 
+def generate_inferance_engine_in_background(data, force_rewrite=False):
+    """Same as generate_inferance_engine, without blocking the caller."""
+    def build(changed_files):
+        generate_inferance_engine(data, force_rewrite=force_rewrite)
+        # dataset changes of a replaced update
+        invalidate_cached_answers(changed_files)
+        return f"Index of {data} ready"
+    index_builder.submit(f"Loading the index of {data}", build)
+
+
+def rebind_inferance_engine():
+    """
+       Rebuild the engine on the loaded index for the current service context.
+
+       The index and its retriever only depend on the embedding model, so a LLM
+       change does not need to read the index again.
+       """
+    global engine
+    engine = faiss_storage.get_engine(is_chat_engine=is_chat_engine, streaming=streaming,
+                                      similarity_top_k=similarity_top_k, service_context=service_context)
+    chat_sessions.clear()
+    if conversations is not None:
+        # contexts are token ids of the model that returned them
+        conversations.clear()
+    update_answer_cache_context()
+
+
+def reference_path(file_name):
+    # path under which a dataset file appears in the references of answers
+    return str(Path(os.path.join(os.getcwd(), file_name.replace('\\', '/'))))
+
+
+def invalidate_cached_answers(changed_files):
+    """
+       Drop the cached answers that may be outdated by changes to some dataset files.
+
+       Those are the answers referencing one of the files, and the answers
+       without references, which the changed files may now cover.
+       """
+    if answer_cache is None or len(changed_files) == 0:
+        return
+    paths = [reference_path(file_name) for file_name in changed_files]
+    dropped = answer_cache.invalidate(
+        lambda answer: REFERENCE_FILES_TITLE not in answer or any(path in answer for path in paths))
+    if dropped > 0:
+        print(f"Dropped {dropped} cached answers")
+
+
+def apply_dataset_changes(data, changed_files):
+    """Update the index of data with the files the dataset watcher saw changing."""
+    if data_source != "directory" or data != data_dir:
+        return
+    def build(changed_files):
+        storage = faiss_storage
+        if storage.data_dir == data and storage.manifest.exists():
+            # the served index is updated in place from its manifest, so only
+            # the changed files are parsed and embedded
+            storage.update_index()
+            index_cache.update(data)
+        else:
+            # replaced the load of data, or an index persisted without manifest
+            index_cache.discard(data)
+            storage = index_cache.get(data, lambda: load_faiss_storage(data, force_rewrite=True))
+            swap_inferance_engine(storage)
+            update_answer_cache_context()
+        invalidate_cached_answers(changed_files)
+        return f"Index of {data} ready"
+    index_builder.submit(f"Updating the index of {data} with {len(changed_files)} changed files", build,
+                         changed_files)
+
+
+# polls the dataset directory and applies file changes to the index being served
+dataset_watcher = None
+if dataset_watcher_config["enabled"]:
+    dataset_watcher = DatasetWatcher(on_change=apply_dataset_changes,
+                                     poll_interval=dataset_watcher_config["poll_interval_seconds"],
+                                     debounce=dataset_watcher_config["debounce_seconds"])
+
+
+def watch_dataset():
+    if dataset_watcher is not None:
+        dataset_watcher.watch(data_dir if data_source == "directory" else None)
+
+
 # load the vectorstore index
 generate_inferance_engine(data_dir)
+watch_dataset()
 
-def call_llm_streamed(query):
-    partial_response = ""
-    response = llm.stream_complete(query)
-    for token in response:
-        partial_response += token.delta
-        yield partial_response
+def get_conversation(session_id):
+    return None if conversations is None else conversations.get(session_id)
+
+def complete(prompt, conversation=None):
+    if conversation is None:
+        return llm.complete(prompt).text
+    response = llm.complete(prompt, **conversation.completion_kwargs())
+    conversation.record(response.raw)
+    return response.text
+
+def call_llm_streamed(query, conversation=None):
+    if conversation is None:
+        response = llm.stream_complete(query)
+        yield from stream_coalescer.coalesce(token.delta for token in response)
+    else:
+        response = llm.stream_complete(query, **conversation.completion_kwargs())
+        yield from stream_coalescer.coalesce(conversation.deltas(response))
 
 def generate_references(response: RESPONSE_TYPE, max_score = 1) -> list[dict] :
     # Aggregate scores by file
@@ -181,9 +466,7 @@ def generate_references(response: RESPONSE_TYPE, max_score = 1) -> list[dict] :
     # Generate links for the file with the lowest avg score
     for relative_file_name, avg_score in file_avg_scores.items():
         if avg_score < max_score:
-            abs_path = Path(os.path.join(os.getcwd(), relative_file_name.replace('\\', '/')))
-            file_name = str(abs_path)
-            #file_name_without_ext = abs_path.stem
+            file_name = reference_path(relative_file_name)
             if file_name not in seen_files:  # Ensure the file hasn't already been processed
                 if data_source == 'directory':
                     file_link = file_name
@@ -200,81 +483,283 @@ def generate_references(response: RESPONSE_TYPE, max_score = 1) -> list[dict] :
             result.append({"filename": x})
     return result
 
+def format_references(file_links):
+    references = ["<br><br>" + REFERENCE_FILES_TITLE]
+    for retrieved_file in file_links:
+        references.append("<br>")
+        references.append("<a href=\"file://%s\">%s</a>"\
+                            %(
+                                retrieved_file.get("filename"),
+                                retrieved_file.get("filename") + " [ p. " +
+                                ", ".join([str(x) for x in sorted(retrieved_file.get("pages"))]) + " ]" if retrieved_file.get("pages")
+                                else retrieved_file.get("filename")
+                            ))
+    return "".join(references)
+
+def retrieved_references(nodes):
+    # files of the retrieved nodes scoring under the threshold, checked before
+    # generating so that a question the dataset does not cover only costs one
+    # plain completion instead of a discarded RAG answer
+    return generate_references(Response("", source_nodes=nodes), max_score=score_threshold_filter)
+
 def chatbot(query, chat_history, session_id):
+    conversation = get_conversation(session_id)
     if data_source == "nodataset":
-        yield llm.complete(query).text
+        yield complete(query, conversation)
         return
 
     if is_chat_engine:
-        response = engine.chat(query)
+        response = chat_sessions.get(session_id).chat(query)
+        # generate file links if any
+        file_links = generate_references(response)
     else:
-        response = engine.query(query)
-
-    # generate file links if any
-    file_links = generate_references(response)
+        query_engine = engine
+        query_bundle = QueryBundle(query)
+        nodes = query_engine.retrieve(query_bundle)
+        file_links = retrieved_references(nodes)
+        if not file_links:
+            yield complete(query, conversation)
+            return
+        if conversation is None:
+            response = query_engine.synthesize(query_bundle, nodes)
+        else:
+            response = complete(conversation_qa_prompt(query_engine, query, nodes, conversation), conversation)
 
     response_txt = str(response)
     if file_links:
         filename_list = [f.get("filename") for f in file_links]
-        response_txt += "<br>Reference files:<br>" + "<br>".join(filename_list)
-    if not file_links or len(file_links) == 0:  # If no file with a high score was found
-        response_txt = llm.complete(query).text
+        response_txt += "<br>" + REFERENCE_FILES_TITLE + "<br>" + "<br>".join(filename_list)
     yield response_txt
 
 def stream_chatbot(query, chat_history, session_id):
+    conversation = get_conversation(session_id)
     if data_source == "nodataset":
-        for response in call_llm_streamed(query):
+        for response in call_llm_streamed(query, conversation):
             yield response
         return
 
+    partial_responses = None
     if is_chat_engine:
-        response = engine.stream_chat(query)
+        response = chat_sessions.get(session_id).stream_chat(query)
+        # generate file links if any
+        file_links = generate_references(response, max_score=score_threshold_filter)
+        if len(response.source_nodes) > 0:
+            partial_responses = stream_coalescer.coalesce(response.response_gen)
     else:
-        response = engine.query(query)
-
-    partial_response = ""
-    if len(response.source_nodes) == 0:
-        response = llm.stream_complete(query)
-        for token in response:
-            partial_response += token.delta
-            yield partial_response
+        query_engine = engine
+        query_bundle = QueryBundle(query)
+        nodes = query_engine.retrieve(query_bundle)
+        file_links = retrieved_references(nodes)
+        if file_links and conversation is not None:
+            prompt = conversation_qa_prompt(query_engine, query, nodes, conversation)
+            partial_responses = call_llm_streamed(prompt, conversation)
+        elif file_links:
+            partial_responses = stream_coalescer.coalesce(query_engine.synthesize(query_bundle, nodes).response_gen)
+
+    if partial_responses is None:
+        yield from call_llm_streamed(query, conversation)
     else:
-        for token in response.response_gen:
-            partial_response += token
+        partial_response = ""
+        for partial_response in partial_responses:
             yield partial_response
-            time.sleep(0.05)
-
-        time.sleep(0.2)
-
-        # generate file links if any
-        file_links = generate_references(response, max_score=score_threshold_filter)
 
         if file_links:
-            partial_response += "<br><br>Reference files:"
-            for retrieved_file in file_links:
-                partial_response += "<br>"
-                partial_response += "<a href=\"file://%s\">%s</a>"\
-                                    %(
-                                        retrieved_file.get("filename"),
-                                        retrieved_file.get("filename") + " [ p. " +
-                                        ", ".join([str(x) for x in sorted(retrieved_file.get("pages"))]) + " ]" if retrieved_file.get("pages")
-                                        else retrieved_file.get("filename")
-                                    )
-
-        yield  partial_response
+            yield partial_response + format_references(file_links)
 
     # call garbage collector after inference
+    release_inference_memory()
+
+def release_inference_memory():
     torch.cuda.empty_cache()
     gc.collect()
 
-interface = MainInterface(chatbot=stream_chatbot if streaming else chatbot, streaming=streaming)
+async def iterate_in_thread(iterator):
+    # runs each step of a blocking generator in a worker thread
+    iterator = iter(iterator)
+    done = object()
+    while True:
+        item = await asyncio.to_thread(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+async def retrieve_nodes(query_engine, query):
+    # embedding the query and searching the index are CPU bound, keep them off the event loop
+    return await asyncio.to_thread(query_engine.retrieve, QueryBundle(query))
+
+def build_qa_prompt(query_engine, query, nodes, text_qa_template=None, prompt_helper=None):
+    # same prompt as the query engine response synthesizer by default, with the
+    # chunks truncated to fit the context window in a single generation
+    if text_qa_template is None:
+        text_qa_template = query_engine.get_prompts()["response_synthesizer:text_qa_template"]
+    prompt_helper = prompt_helper or service_context.prompt_helper
+    text_qa_template = text_qa_template.partial_format(query_str=query)
+    text_chunks = [node.node.get_content(metadata_mode=MetadataMode.LLM) for node in nodes]
+    text_chunks = prompt_helper.truncate(prompt=text_qa_template, text_chunks=text_chunks)
+    return text_qa_template, "\n".join(text_chunks)
+
+def conversation_qa_prompt(query_engine, query, nodes, conversation):
+    # the previous turns, this prompt and its answer become the context of the
+    # next turn: they must fit max_tokens of the conversation, itself below the
+    # context window, or Ollama would truncate the prefix meant to be reused
+    budget = conversation.max_tokens - conversation.context_size()
+    if budget < conversation.max_tokens // 2:
+        # too little room left for the retrieved chunks
+        conversation.start_over()
+        budget = conversation.max_tokens
+    prompt_helper = service_context.prompt_helper
+    prompt_helper = PromptHelper(context_window=budget, num_output=prompt_helper.num_output,
+                                 chunk_overlap_ratio=prompt_helper.chunk_overlap_ratio,
+                                 chunk_size_limit=prompt_helper.chunk_size_limit,
+                                 separator=prompt_helper.separator)
+    text_qa_template, context_str = build_qa_prompt(query_engine, query, nodes, CONVERSATION_QA_PROMPT,
+                                                    prompt_helper)
+    return text_qa_template.format(context_str=context_str)
+
+async def acomplete(prompt, conversation=None):
+    if conversation is None:
+        return (await llm.acomplete(prompt)).text
+    response = await llm.acomplete(prompt, **conversation.completion_kwargs())
+    conversation.record(response.raw)
+    return response.text
+
+async def acall_llm_streamed(query, conversation=None):
+    if conversation is None:
+        response = await llm.astream_complete(query)
+        deltas = (token.delta async for token in response)
+    else:
+        response = await llm.astream_complete(query, **conversation.completion_kwargs())
+        deltas = conversation.adeltas(response)
+    async for partial_response in stream_coalescer.acoalesce(deltas):
+        yield partial_response
+
+async def achatbot(query, chat_history, session_id):
+    conversation = get_conversation(session_id)
+    if data_source == "nodataset":
+        yield await acomplete(query, conversation)
+        return
+
+    if is_chat_engine:
+        # the condense question chat engine has no async path in llama_index
+        async for response_txt in iterate_in_thread(chatbot(query, chat_history, session_id)):
+            yield response_txt
+        return
+
+    query_engine = engine
+    nodes = await retrieve_nodes(query_engine, query)
+    file_links = retrieved_references(nodes)
+    if not file_links:
+        yield await acomplete(query, conversation)
+        return
+
+    if conversation is None:
+        text_qa_template, context_str = build_qa_prompt(query_engine, query, nodes)
+        response_txt = await llm.apredict(text_qa_template, context_str=context_str)
+    else:
+        response_txt = await acomplete(conversation_qa_prompt(query_engine, query, nodes, conversation), conversation)
+    filename_list = [f.get("filename") for f in file_links]
+    response_txt += "<br>" + REFERENCE_FILES_TITLE + "<br>" + "<br>".join(filename_list)
+    yield response_txt
+
+async def astream_chatbot(query, chat_history, session_id):
+    conversation = get_conversation(session_id)
+    if data_source == "nodataset":
+        async for response in acall_llm_streamed(query, conversation):
+            yield response
+        return
+
+    if is_chat_engine:
+        # the condense question chat engine has no async streaming in llama_index
+        async for response in iterate_in_thread(stream_chatbot(query, chat_history, session_id)):
+            yield response
+        return
+
+    query_engine = engine
+    nodes = await retrieve_nodes(query_engine, query)
+    file_links = retrieved_references(nodes)
+    if not file_links:
+        async for response in acall_llm_streamed(query, conversation):
+            yield response
+    else:
+        if conversation is None:
+            text_qa_template, context_str = build_qa_prompt(query_engine, query, nodes)
+            tokens = await llm.astream(text_qa_template, context_str=context_str)
+            partial_responses = stream_coalescer.acoalesce(tokens)
+        else:
+            prompt = conversation_qa_prompt(query_engine, query, nodes, conversation)
+            partial_responses = acall_llm_streamed(prompt, conversation)
+        partial_response = ""
+        async for partial_response in partial_responses:
+            yield partial_response
+        yield partial_response + format_references(file_links)
+
+    # call garbage collector after inference, off the event loop
+    await asyncio.to_thread(release_inference_memory)
+
+def follows_previous_turns(session_id):
+    # answers generated with the Ollama context of previous turns depend on
+    # them, and answering from the cache would not record the turn
+    conversation = get_conversation(session_id)
+    return conversation is not None and conversation.context is not None
+
+def with_answer_cache(chatbot_handler):
+    # the chat engine condenses each question with the conversation history,
+    # so its answers cannot be reused for another conversation
+    if answer_cache is None or is_chat_engine:
+        return chatbot_handler
+
+    if inspect.isasyncgenfunction(chatbot_handler):
+        async def acached_chatbot(query, chat_history, session_id):
+            if follows_previous_turns(session_id):
+                async for answer in chatbot_handler(query, chat_history, session_id):
+                    yield answer
+                return
+            answer = await asyncio.to_thread(answer_cache.lookup, query)
+            if answer is not None:
+                print("Answer cache hit for", query)
+                for answer in replay_answer(answer) if streaming else [answer]:
+                    yield answer
+                return
+            async for answer in chatbot_handler(query, chat_history, session_id):
+                yield answer
+            if answer:
+                await asyncio.to_thread(answer_cache.store, query, answer)
+        return acached_chatbot
+
+    def cached_chatbot(query, chat_history, session_id):
+        if follows_previous_turns(session_id):
+            yield from chatbot_handler(query, chat_history, session_id)
+            return
+        answer = answer_cache.lookup(query)
+        if answer is not None:
+            print("Answer cache hit for", query)
+            yield from replay_answer(answer) if streaming else [answer]
+            return
+        for answer in chatbot_handler(query, chat_history, session_id):
+            yield answer
+        if answer:
+            answer_cache.store(query, answer)
+    return cached_chatbot
+
+if async_pipeline:
+    chatbot_handler = astream_chatbot if streaming else achatbot
+else:
+    chatbot_handler = stream_chatbot if streaming else chatbot
+interface = MainInterface(chatbot=with_answer_cache(chatbot_handler), streaming=streaming,
+                          stream_deltas=stream_deltas, concurrency_limit=concurrency_limit)
 
 def on_shutdown_handler(session_id):
     global llm, service_context, embed_model, faiss_storage, engine
     import gc
-    # if llm is not None:
-    #     llm.unload_model()
-    #     del llm
+    if dataset_watcher is not None:
+        dataset_watcher.stop()
+    if answer_cache is not None:
+        answer_cache.flush()
+    if llm is not None:
+        try:
+            llm.unload_model()
+        except Exception as e:
+            print(f"Unable to unload {llm.model}: {e}")
     # Force a garbage collection cycle
     gc.collect()
 
@@ -283,16 +768,26 @@ interface.on_shutdown(on_shutdown_handler)
 
 
 def reset_chat_handler(session_id):
-    global faiss_storage
-    global engine
     print('reset chat called', session_id)
     if is_chat_engine == True:
-        faiss_storage.reset_engine(engine)
+        chat_sessions.reset(session_id)
+    if conversations is not None:
+        conversations.reset(session_id)
 
 
 interface.on_reset_chat(reset_chat_handler)
 
 
+def rewind_chat_handler(history, session_id):
+    # the last answer was undone or is asked again
+    if conversations is not None:
+        conversations.get(session_id).rewind()
+
+
+interface.on_undo_last_chat(rewind_chat_handler)
+interface.on_retry_chat(rewind_chat_handler)
+
+
 def on_dataset_path_updated_handler(source, new_directory, video_count, session_id):
     print('data set path updated to ', source, new_directory, video_count, session_id)
     global engine
@@ -300,18 +795,35 @@ def on_dataset_path_updated_handler(source, new_directory, video_count, session_
     if source == 'directory':
         if data_dir != new_directory:
             data_dir = new_directory
-            generate_inferance_engine(data_dir)
+            generate_inferance_engine_in_background(data_dir)
+            watch_dataset()
 
 interface.on_dataset_path_updated(on_dataset_path_updated_handler)
 
+def swap_ollama_models(previous_llm, new_llm):
+    # free the memory of the previous model before loading the selected one,
+    # so that the first question does not pay for the load
+    try:
+        if previous_llm.model != new_llm.model:
+            previous_llm.unload_model()
+        new_llm.load_model()
+        print(f"Model {new_llm.model} loaded")
+    except Exception as e:
+        print(f"Unable to load {new_llm.model}: {e}")
+
 def on_model_change_handler(model, metadata, session_id):
 
-    global llm, embedded_model, engine, data_dir, service_context
+    global llm, embedded_model, engine, data_dir, service_context, model_config
 
-    llm = Ollama(model=model, base_url=base_url)
-    service_context = ServiceContext.from_service_context(service_context=service_context, llm=llm)
+    previous_llm = llm
+    model_config = get_model_config(config, model)
+    llm = AsyncOllama(model=model, base_url=base_url, keep_alive=model_config["keep_alive"],
+                      context_window=model_config["max_input_token"])
+    threading.Thread(target=swap_ollama_models, args=(previous_llm, llm), daemon=True).start()
+    service_context = ServiceContext.from_service_context(service_context=service_context, llm=llm,
+                                                          context_window=model_config["max_input_token"])
     set_global_service_context(service_context)
-    generate_inferance_engine(data_dir)
+    rebind_inferance_engine()
 
 
 interface.on_model_change(on_model_change_handler)
@@ -324,6 +836,8 @@ def on_dataset_source_change_handler(source, path, session_id):
 
     if data_source == "nodataset":
         print(' No dataset source selected', session_id)
+        update_answer_cache_context()
+        watch_dataset()
         return
     
     print('dataset source updated ', source, path, session_id)
@@ -332,14 +846,60 @@ def on_dataset_source_change_handler(source, path, session_id):
         data_dir = path
     else:
         print("Wrong data type selected")
-    generate_inferance_engine(data_dir)
+    generate_inferance_engine_in_background(data_dir)
+    watch_dataset()
 
 interface.on_dataset_source_updated(on_dataset_source_change_handler)
 
 def handle_regenerate_index(source, path, session_id):
-    generate_inferance_engine(path, force_rewrite=True)
+    generate_inferance_engine_in_background(path, force_rewrite=True)
     print("on regenerate index", source, path, session_id)
 
 interface.on_regenerate_index(handle_regenerate_index)
+interface.on_index_status(lambda: (index_builder.status(), index_builder.is_building()))
+
+WARM_UP_SESSION_ID = "warm-up"
+
+def answer_sample_questions():
+    # answered by the same handler as the UI, the sync variant producing the
+    # same answers, so that clicking a sample question is an answer cache hit
+    if answer_cache is None or is_chat_engine:
+        return
+    cached_chatbot = with_answer_cache(stream_chatbot if streaming else chatbot)
+    for sample_question in config.get("sample_questions", []):
+        query = sample_question["query"]
+        if answer_cache.lookup(query) is not None:
+            continue
+        for _ in cached_chatbot(query, [], WARM_UP_SESSION_ID):
+            pass
+        if conversations is not None:
+            conversations.reset(WARM_UP_SESSION_ID)
+    print("Sample questions answered")
+
+def warm_up():
+    """
+       Pay the costs of the first question before it is asked: lazy model
+       initialization, cold index pages and the Ollama model load.
+       """
+    try:
+        embed_model.embed_query("warm up")
+        query_engine = engine
+        if is_chat_engine:
+            # the query engine under the chat engine, retrieving under the storage lock
+            query_engine = faiss_storage.get_engine(is_chat_engine=False, streaming=streaming,
+                                                    similarity_top_k=similarity_top_k,
+                                                    service_context=service_context)
+        # also loads the models of the retrieval postprocessors
+        query_engine.retrieve(QueryBundle("warm up"))
+        llm.load_model()
+        print("Warm-up done")
+        if warm_up_config["sample_questions"]:
+            answer_sample_questions()
+    except Exception as e:
+        print(f"Warm-up failed: {e}")
+
+if warm_up_config["enabled"]:
+    # runs while the interface starts, render() blocks until the app exits
+    threading.Thread(target=warm_up, daemon=True).start()
 # render the interface
 interface.render()
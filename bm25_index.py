@@ -0,0 +1,173 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+import heapq
+import json
+import math
+import os
+import re
+from collections import Counter
+
+BM25_FILE_NAME = "bm25_index.json"
+BM25_VERSION = 1
+# words, and identifiers such as part numbers, error codes or versions kept whole
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./:]\w+)*")
+TOKEN_SEPARATORS = re.compile(r"[-./:]")
+
+
+def tokenize(text):
+    """
+    Lowercase terms of text. Compound identifiers like "ab-1234.5" are kept
+    whole and also split in their parts, so that both spellings match.
+    """
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        terms.append(token)
+        parts = TOKEN_SEPARATORS.split(token)
+        if len(parts) > 1:
+            terms.extend(part for part in parts if part)
+    return terms
+
+
+class HybridSearchOptions:
+    """
+    Lexical search settings read from the "hybrid_search" section of app_config.json.
+
+    candidates chunks are retrieved from FAISS and from the BM25 index, and
+    the two rankings are fused by reciprocal rank (1 / (rrf_k + rank)).
+    """
+
+    def __init__(self, enabled=False, candidates=20, rrf_k=60, bm25_k1=1.2, bm25_b=0.75):
+        self.enabled = enabled
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.bm25_k1 = bm25_k1
+        self.bm25_b = bm25_b
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(**config) if config else cls()
+
+
+class BM25Index:
+    """
+    Inverted index of the docstore nodes, scored with Okapi BM25.
+
+    Persisted as BM25_FILE_NAME next to the FAISS index, with node ids stored
+    once and postings as flat [node position, term frequency, ...] lists.
+    """
+
+    def __init__(self, persist_dir, k1=1.2, b=0.75):
+        self.path = os.path.join(persist_dir, BM25_FILE_NAME)
+        self.k1 = k1
+        self.b = b
+        # term -> {node id: term frequency}
+        self.postings = {}
+        # node id -> number of terms
+        self.lengths = {}
+        # node id -> its distinct terms, so that removing a node only visits their postings
+        self.terms = {}
+        self.total_length = 0
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        with open(self.path, 'r') as file:
+            data = json.load(file)
+        if data.get("version") != BM25_VERSION:
+            raise ValueError(f"Unsupported BM25 index version in {self.path}")
+        node_ids = data["node_ids"]
+        self.lengths = dict(zip(node_ids, data["lengths"]))
+        self.total_length = sum(self.lengths.values())
+        self.postings = {term: {node_ids[flat[i]]: flat[i + 1] for i in range(0, len(flat), 2)}
+                         for term, flat in data["postings"].items()}
+        self.terms = {node_id: [] for node_id in node_ids}
+        for term, frequencies in self.postings.items():
+            for node_id in frequencies:
+                self.terms[node_id].append(term)
+        return self
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        node_ids = list(self.lengths)
+        positions = {node_id: position for position, node_id in enumerate(node_ids)}
+        postings = {}
+        for term, frequencies in self.postings.items():
+            flat = []
+            for node_id, frequency in frequencies.items():
+                flat.extend((positions[node_id], frequency))
+            postings[term] = flat
+        data = {
+            "version": BM25_VERSION,
+            "node_ids": node_ids,
+            "lengths": [self.lengths[node_id] for node_id in node_ids],
+            "postings": postings
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(data, file, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+    def add(self, node_id, text):
+        if node_id in self.lengths:
+            self.remove([node_id])
+        terms = tokenize(text)
+        frequencies = Counter(terms)
+        for term, frequency in frequencies.items():
+            self.postings.setdefault(term, {})[node_id] = frequency
+        self.terms[node_id] = list(frequencies)
+        self.lengths[node_id] = len(terms)
+        self.total_length += len(terms)
+
+    def remove(self, node_ids):
+        for node_id in set(node_ids):
+            if node_id not in self.lengths:
+                continue
+            self.total_length -= self.lengths.pop(node_id)
+            for term in self.terms.pop(node_id):
+                frequencies = self.postings[term]
+                del frequencies[node_id]
+                if len(frequencies) == 0:
+                    del self.postings[term]
+
+    def search(self, query, top_k):
+        """
+        Returns:
+            up to top_k (node id, BM25 score) pairs, best first.
+        """
+        count = len(self.lengths)
+        if count == 0:
+            return []
+        average_length = self.total_length / count
+        scores = Counter()
+        for term in set(tokenize(query)):
+            frequencies = self.postings.get(term)
+            if not frequencies:
+                continue
+            idf = math.log(1 + (count - len(frequencies) + 0.5) / (len(frequencies) + 0.5))
+            for node_id, frequency in frequencies.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[node_id] / average_length)
+                scores[node_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+    def memory_usage(self):
+        """Rough estimate of the memory held by the index, in bytes."""
+        return sum(len(frequencies) for frequencies in self.postings.values()) * 160 + len(self.lengths) * 200
@@ -0,0 +1,75 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+import threading
+import time
+from collections import OrderedDict
+
+
+class ChatSessionPool:
+    """
+    Chat engines keyed by browser session, so that every session keeps its own
+    conversation memory.
+
+    Engines are created on first use by engine_factory, which is expected to
+    build them on top of the one shared index. The least recently used engines
+    are dropped beyond max_sessions, and engines of sessions idle for more than
+    idle_timeout seconds (0 disables it) are dropped on the next access.
+    """
+
+    def __init__(self, engine_factory, max_sessions=32, idle_timeout=1800):
+        self.engine_factory = engine_factory
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        # session id -> (engine, last used time), least recently used first
+        self._sessions = OrderedDict()
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            if session_id in self._sessions:
+                engine, _ = self._sessions.pop(session_id)
+            else:
+                engine = self.engine_factory()
+            self._sessions[session_id] = (engine, now)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return engine
+
+    def reset(self, session_id):
+        """Forget the conversation of one session."""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def clear(self):
+        """Drop every engine, e.g. once the index or the LLM they use changed."""
+        with self._lock:
+            self._sessions.clear()
+
+    def _evict_idle(self, now):
+        if self.idle_timeout <= 0:
+            return
+        while len(self._sessions) > 0:
+            session_id, (_, last_used) = next(iter(self._sessions.items()))
+            if now - last_used < self.idle_timeout:
+                break
+            del self._sessions[session_id]
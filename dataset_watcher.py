@@ -0,0 +1,105 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+import os
+import threading
+import time
+
+from index_manifest import list_dataset_files
+
+
+def take_snapshot(data_dir):
+    """Map each dataset file to its size and modification time."""
+    snapshot = {}
+    for file_path in list_dataset_files(data_dir):
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            continue
+        snapshot[file_path] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+
+class DatasetWatcher:
+    """
+    Polls a dataset directory and reports the files that changed in it.
+
+    Changes are reported once no file has changed for debounce seconds, so
+    that copying many files triggers a single on_change(data_dir, changed)
+    call, where changed lists every added, modified or removed file. Polling
+    needs no OS notification service and works on network folders.
+    """
+
+    def __init__(self, on_change, poll_interval=5, debounce=10):
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._data_dir = None
+        # files of the watched directory on the last poll, None until the first one
+        self._snapshot = None
+        self._changed = set()
+        self._last_change = 0
+
+    def watch(self, data_dir):
+        """Watch data_dir instead of the current directory, None to pause."""
+        with self._lock:
+            self._data_dir = data_dir
+            self._snapshot = None
+            self._changed = set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            with self._lock:
+                data_dir = self._data_dir
+            if data_dir is None:
+                continue
+            snapshot = take_snapshot(data_dir)
+            now = time.monotonic()
+            report = None
+            with self._lock:
+                if data_dir != self._data_dir:
+                    # switched to another directory while polling
+                    continue
+                if self._snapshot is None:
+                    self._snapshot = snapshot
+                    continue
+                changed = {file_path for file_path in snapshot.keys() | self._snapshot.keys()
+                           if snapshot.get(file_path) != self._snapshot.get(file_path)}
+                if changed:
+                    self._changed |= changed
+                    self._snapshot = snapshot
+                    self._last_change = now
+                elif self._changed and now - self._last_change >= self.debounce:
+                    report = sorted(self._changed)
+                    self._changed = set()
+            if report is not None:
+                try:
+                    self.on_change(data_dir, report)
+                except Exception as e:
+                    print(f"Unable to apply the changes of {data_dir}: {e}")
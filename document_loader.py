@@ -0,0 +1,122 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+import multiprocessing
+import os
+import time
+import uuid
+
+from llama_index import SimpleDirectoryReader
+
+
+def load_file(file_path):
+    file_metadata = lambda x: {"filename": x}
+    # filename based ids, together with chunk_id for the nodes, keep the
+    # persisted docstore identical between two builds
+    return SimpleDirectoryReader(input_files=[file_path], file_metadata=file_metadata,
+                                 filename_as_id=True).load_data()
+
+
+def chunk_id(i, document):
+    """Node id of the i-th chunk of document, the same on every build, to use as node parser id_func."""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{document.doc_id}#{i}"))
+
+
+class ParallelDocumentLoader:
+    """
+    Parses dataset files in a pool of worker processes.
+
+    Files larger than max_file_size_mb are skipped, and a file whose parsing
+    takes more than file_timeout seconds is abandoned: the pool is terminated
+    and restarted for the files that were still pending. Documents are always
+    returned in the order of the input file list, whatever order the workers
+    finish in.
+
+    The pool relies on the fork start method, since spawned workers would
+    re-execute app.py; where fork is unavailable (Windows) files are parsed
+    serially in the calling process.
+    """
+
+    def __init__(self, workers=1, max_file_size_mb=0, file_timeout=0):
+        self.workers = workers if workers > 0 else os.cpu_count() or 1
+        self.max_file_size = max_file_size_mb * 1024 * 1024
+        self.file_timeout = file_timeout if file_timeout > 0 else None
+
+    def load(self, file_paths):
+        """
+        Returns:
+            list of (file_path, documents) tuples, in the order of file_paths,
+            for the files that were parsed. Skipped, failed and timed out
+            files are left out.
+        """
+        start = time.time()
+        accepted = []
+        for file_path in file_paths:
+            if self.max_file_size and os.path.getsize(file_path) > self.max_file_size:
+                print(f"Skipping {file_path}: larger than {self.max_file_size // (1024 * 1024)} MB")
+            else:
+                accepted.append(file_path)
+
+        workers = min(self.workers, len(accepted))
+        if workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+            results = self._load_parallel(accepted, workers)
+        else:
+            results = self._load_serial(accepted)
+
+        if len(file_paths) > 0:
+            print(f"Parsed {len(accepted)} files with {max(workers, 1)} worker(s) in {time.time() - start:.1f}s")
+        return [(file_path, results[file_path]) for file_path in file_paths if file_path in results]
+
+    def _load_serial(self, file_paths):
+        results = {}
+        for file_path in file_paths:
+            try:
+                results[file_path] = load_file(file_path)
+            except Exception as e:
+                print(f"Failed to load file {file_path} with error: {e}. Skipping...")
+        return results
+
+    def _load_parallel(self, file_paths, workers):
+        results = {}
+        pending = list(file_paths)
+        context = multiprocessing.get_context("fork")
+        while pending:
+            pool = context.Pool(processes=min(workers, len(pending)))
+            submitted = [(file_path, pool.apply_async(load_file, (file_path,))) for file_path in pending]
+            pending = []
+            timed_out = False
+            try:
+                for file_path, async_result in submitted:
+                    # once a worker is stuck the pool gets terminated, so only keep
+                    # what is already done and resubmit the rest to a fresh pool
+                    if timed_out and not async_result.ready():
+                        pending.append(file_path)
+                        continue
+                    try:
+                        results[file_path] = async_result.get(timeout=self.file_timeout)
+                    except multiprocessing.TimeoutError:
+                        print(f"Parsing {file_path} took more than {self.file_timeout}s. Skipping...")
+                        timed_out = True
+                    except Exception as e:
+                        print(f"Failed to load file {file_path} with error: {e}. Skipping...")
+            finally:
+                pool.terminate()
+                pool.join()
+        return results
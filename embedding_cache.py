@@ -0,0 +1,159 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+KEYS_FILE_NAME = "keys.npy"
+VECTORS_FILE_NAME = "vectors.npy"
+KEY_DTYPE = np.dtype([("hash", "u1", (32,)), ("last_used", "<i8")])
+EMPTY_KEY = bytes(32)
+INITIAL_SLOTS = 1024
+
+
+def text_key(text):
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    On-disk cache of embeddings keyed by (embedding model, sha256 of the text).
+
+    Each model gets its own directory holding two .npy files opened as memory
+    maps: the vectors (float32, slots x dimension) and the slot keys (text
+    hash, last use tick). The files start small and double in size when full,
+    up to a capacity derived from max_size_mb; from there, the least recently
+    used tenth of the slots is evicted to make room.
+    """
+
+    def __init__(self, cache_dir, model_name, dimension, max_size_mb=1024):
+        self.dir = os.path.join(cache_dir, model_name.replace("/", "__"))
+        self.dimension = dimension
+        self.capacity = max(1, (max_size_mb * 1024 * 1024) // (dimension * 4 + KEY_DTYPE.itemsize))
+        self._keys_path = os.path.join(self.dir, KEYS_FILE_NAME)
+        self._vectors_path = os.path.join(self.dir, VECTORS_FILE_NAME)
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        os.makedirs(self.dir, exist_ok=True)
+        try:
+            self._keys = np.lib.format.open_memmap(self._keys_path, mode="r+")
+            self._vectors = np.lib.format.open_memmap(self._vectors_path, mode="r+")
+            if self._keys.ndim != 1 or len(self._keys) > self.capacity \
+                    or self._vectors.shape != (len(self._keys), self.dimension):
+                raise ValueError("cache size or embedding dimension changed")
+        except (OSError, ValueError) as e:
+            print(f"Creating a new embedding cache in {self.dir} ({e})")
+            self._keys, self._vectors = self._create(self._keys_path, self._vectors_path,
+                                                     min(INITIAL_SLOTS, self.capacity))
+
+        used = self._keys["hash"].any(axis=1)
+        used_slots = np.flatnonzero(used)
+        self._slots = {key.tobytes(): slot for key, slot in zip(self._keys["hash"][used_slots], used_slots.tolist())}
+        # popped from the end, lowest slots first
+        self._free = np.flatnonzero(~used)[::-1].tolist()
+        self._tick = int(self._keys["last_used"].max()) + 1 if len(self._slots) else 0
+
+    def _create(self, keys_path, vectors_path, size):
+        keys = np.lib.format.open_memmap(keys_path, mode="w+", dtype=KEY_DTYPE, shape=(size,))
+        vectors = np.lib.format.open_memmap(vectors_path, mode="w+", dtype="float32", shape=(size, self.dimension))
+        return keys, vectors
+
+    def _grow(self, count):
+        """Make room for count more slots without evicting, as far as the capacity allows."""
+        size = len(self._keys)
+        new_size = min(self.capacity, max(size * 2, size + count))
+        if new_size <= size:
+            return
+        keys, vectors = self._create(self._keys_path + ".tmp", self._vectors_path + ".tmp", new_size)
+        keys[:size] = self._keys
+        vectors[:size] = self._vectors
+        keys.flush()
+        vectors.flush()
+        # the previous maps must be closed before their files are replaced
+        del keys, vectors
+        self._keys = self._vectors = None
+        os.replace(self._keys_path + ".tmp", self._keys_path)
+        os.replace(self._vectors_path + ".tmp", self._vectors_path)
+        self._keys = np.lib.format.open_memmap(self._keys_path, mode="r+")
+        self._vectors = np.lib.format.open_memmap(self._vectors_path, mode="r+")
+        self._free = list(range(new_size - 1, size - 1, -1)) + self._free
+
+    def __len__(self):
+        return len(self._slots)
+
+    def get_many(self, texts):
+        """
+        Returns:
+            a list with, for each text, its cached vector or None.
+        """
+        result = []
+        with self._lock:
+            for text in texts:
+                slot = self._slots.get(text_key(text))
+                if slot is None:
+                    result.append(None)
+                else:
+                    self._keys["last_used"][slot] = self._tick
+                    result.append(np.array(self._vectors[slot]))
+            self._tick += 1
+        return result
+
+    def put_many(self, texts, vectors):
+        texts, vectors = list(texts)[-self.capacity:], np.asarray(vectors, dtype="float32")[-self.capacity:]
+        with self._lock:
+            new_keys = [key for key in {text_key(text) for text in texts} if key not in self._slots]
+            if len(new_keys) > len(self._free):
+                self._grow(len(new_keys) - len(self._free))
+            if len(new_keys) > len(self._free):
+                self._evict(max(len(new_keys) - len(self._free), self.capacity // 10))
+            for text, vector in zip(texts, vectors):
+                key = text_key(text)
+                slot = self._slots.get(key)
+                if slot is None:
+                    if len(self._free) == 0:
+                        self._grow(1)
+                    if len(self._free) == 0:
+                        self._evict(max(1, self.capacity // 10))
+                    slot = self._free.pop()
+                    self._slots[key] = slot
+                    self._keys["hash"][slot] = np.frombuffer(key, dtype="u1")
+                self._keys["last_used"][slot] = self._tick
+                self._vectors[slot] = vector
+            self._tick += 1
+
+    def _evict(self, count):
+        used = np.array(sorted(self._slots.values()), dtype="int64")
+        count = min(count, len(used))
+        oldest = used[np.argpartition(self._keys["last_used"][used], count - 1)[:count]]
+        for slot in oldest:
+            del self._slots[self._keys["hash"][slot].tobytes()]
+            self._keys["hash"][slot] = 0
+            self._free.append(int(slot))
+        print(f"Evicted {count} entries from the embedding cache")
+
+    def flush(self):
+        with self._lock:
+            self._keys.flush()
+            self._vectors.flush()
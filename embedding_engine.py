@@ -0,0 +1,79 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+import time
+
+import numpy as np
+from llama_index.schema import MetadataMode
+
+
+class EmbeddingEngine:
+    """
+    Computes chunk embeddings for index builds.
+
+    Texts are sorted by length before being cut into batches of batch_size,
+    so each batch pads to a similar sequence length. On CPU, torch already
+    spreads each batch over all the cores.
+
+    Args:
+        embed_model: the langchain HuggingFaceEmbeddings used by the service context,
+            so that build time and query time embeddings come from the same encoder.
+    """
+
+    def __init__(self, embed_model, batch_size=32):
+        self.model = embed_model.client
+        self.encode_kwargs = embed_model.encode_kwargs
+        self.model_name = embed_model.model_name
+        self.batch_size = batch_size
+
+    def encode(self, texts):
+        # same preprocessing as HuggingFaceEmbeddings.embed_documents
+        texts = [text.replace("\n", " ") for text in texts]
+        return np.asarray(self.model.encode(texts, batch_size=self.batch_size, show_progress_bar=False,
+                                            convert_to_numpy=True, **self.encode_kwargs), dtype="float32")
+
+    def embed_texts(self, texts):
+        if len(texts) == 0:
+            return np.zeros((0, 0), dtype="float32")
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        batches = [[texts[i] for i in order[start:start + self.batch_size]]
+                   for start in range(0, len(order), self.batch_size)]
+        encoded = [self.encode(batch) for batch in batches]
+
+        sorted_embeddings = np.vstack(encoded)
+        embeddings = np.empty_like(sorted_embeddings)
+        embeddings[order] = sorted_embeddings
+        return embeddings
+
+    def embed_nodes(self, nodes):
+        """
+        Set the embedding of every node that does not have one yet, using the
+        same text llama_index would embed.
+        """
+        nodes = [node for node in nodes if node.embedding is None]
+        if len(nodes) == 0:
+            return
+        start = time.time()
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        embeddings = self.embed_texts(texts)
+        for node, embedding in zip(nodes, embeddings):
+            node.embedding = embedding.tolist()
+        elapsed = max(time.time() - start, 1e-6)
+        print(f"Embedded {len(nodes)} chunks in {elapsed:.1f}s ({len(nodes) / elapsed:.1f} chunks/s)")
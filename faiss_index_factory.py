@@ -0,0 +1,142 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+import math
+
+import faiss
+import numpy as np
+
+INDEX_TYPE_FLAT = "flat"
+INDEX_TYPE_IVF_FLAT = "ivf_flat"
+INDEX_TYPE_HNSW = "hnsw"
+INDEX_TYPE_AUTO = "auto"
+
+
+class FaissIndexOptions:
+    """
+    Index type and tuning knobs read from the "faiss_index" section of app_config.json.
+
+    With index_type "auto", corpora smaller than auto_threshold vectors use an
+    exact flat index and bigger ones use auto_index_type.
+    """
+
+    def __init__(self, index_type=INDEX_TYPE_FLAT, auto_threshold=100000, auto_index_type=INDEX_TYPE_HNSW,
+                 ivf_nlist=0, ivf_nprobe=16, hnsw_m=32, hnsw_ef_construction=200, hnsw_ef_search=64,
+                 training_sample_size=100000, mmap=False):
+        if index_type not in [INDEX_TYPE_FLAT, INDEX_TYPE_IVF_FLAT, INDEX_TYPE_HNSW, INDEX_TYPE_AUTO]:
+            raise ValueError(f"Unsupported faiss index type {index_type}")
+        self.index_type = index_type
+        self.auto_threshold = auto_threshold
+        self.auto_index_type = auto_index_type
+        self.ivf_nlist = ivf_nlist
+        self.ivf_nprobe = ivf_nprobe
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.hnsw_ef_search = hnsw_ef_search
+        self.training_sample_size = training_sample_size
+        # open persisted indexes memory mapped and read-only
+        self.mmap = mmap
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(**config) if config else cls()
+
+    def resolve_index_type(self, vector_count):
+        if vector_count == 0:
+            # nothing to train on yet
+            return INDEX_TYPE_FLAT
+        if self.index_type == INDEX_TYPE_AUTO:
+            return self.auto_index_type if vector_count >= self.auto_threshold else INDEX_TYPE_FLAT
+        return self.index_type
+
+
+def get_index_type(faiss_index):
+    if faiss.try_extract_index_ivf(faiss_index) is not None:
+        return INDEX_TYPE_IVF_FLAT
+    if hasattr(faiss_index, "id_map"):
+        faiss_index = faiss.downcast_index(faiss_index.index)
+    if isinstance(faiss_index, faiss.IndexHNSW):
+        return INDEX_TYPE_HNSW
+    return INDEX_TYPE_FLAT
+
+
+def create_faiss_index(index_type, dimension, options, training_vectors=None):
+    """
+    Create an empty index accepting add_with_ids.
+
+    IVF indexes keep the ids natively, with a hashtable direct map so that
+    vectors can be reconstructed and removed by id. IndexIDMap2 is not used
+    for them since its remove_ids assumes the wrapped index renumbers vectors
+    on removal, which IVF does not.
+    """
+    if index_type == INDEX_TYPE_IVF_FLAT:
+        count = len(training_vectors)
+        nlist = options.ivf_nlist if options.ivf_nlist > 0 else int(4 * math.sqrt(count))
+        # faiss wants ~39 training points per centroid
+        nlist = max(1, min(nlist, count // 39))
+        faiss_index = faiss.index_factory(dimension, f"IVF{nlist},Flat")
+        faiss_index.train(sample_vectors(training_vectors, options.training_sample_size))
+        faiss.extract_index_ivf(faiss_index).set_direct_map_type(faiss.DirectMap.Hashtable)
+    elif index_type == INDEX_TYPE_HNSW:
+        faiss_index = faiss.index_factory(dimension, f"IDMap2,HNSW{options.hnsw_m},Flat")
+        faiss.downcast_index(faiss_index.index).hnsw.efConstruction = options.hnsw_ef_construction
+    else:
+        faiss_index = faiss.index_factory(dimension, "IDMap2,Flat")
+    apply_search_options(faiss_index, options)
+    return faiss_index
+
+
+def read_faiss_index(persist_path, mmap=False):
+    """
+    Read a persisted index, memory mapped when mmap is set.
+
+    IO_FLAG_MMAP maps the inverted lists of IVF indexes; faiss builds that
+    define IO_FLAG_MMAP_IFC (1.11 and later) can also map the codes of flat and HNSW
+    storages. Whatever cannot be mapped is read in memory.
+    """
+    if mmap:
+        mmap_flags = [faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY]
+        if hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+            mmap_flags.insert(0, mmap_flags[0] | faiss.IO_FLAG_MMAP_IFC)
+        for flags in mmap_flags:
+            try:
+                return faiss.read_index(persist_path, flags)
+            except RuntimeError:
+                pass
+        print(f"Unable to memory map {persist_path}, loading it in memory")
+    return faiss.read_index(persist_path)
+
+
+def apply_search_options(faiss_index, options):
+    ivf_index = faiss.try_extract_index_ivf(faiss_index)
+    if ivf_index is not None:
+        ivf_index.nprobe = options.ivf_nprobe
+    elif hasattr(faiss_index, "id_map"):
+        inner_index = faiss.downcast_index(faiss_index.index)
+        if isinstance(inner_index, faiss.IndexHNSW):
+            inner_index.hnsw.efSearch = options.hnsw_ef_search
+
+
+def sample_vectors(vectors, sample_size):
+    if sample_size <= 0 or len(vectors) <= sample_size:
+        return vectors
+    # fixed seed so that two builds of the same corpus train the same centroids
+    rows = np.random.default_rng(0).choice(len(vectors), size=sample_size, replace=False)
+    return vectors[np.sort(rows)]
@@ -18,56 +18,536 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
+import asyncio
 import faiss
 import os
 import shutil
 import gc
+import threading
+import weakref
+import numpy as np
 import torch
+from collections import defaultdict
+from typing import Any, List, Optional
+from llama_index.bridge.pydantic import PrivateAttr
 from llama_index.vector_stores import FaissVectorStore
-from llama_index import VectorStoreIndex, SimpleDirectoryReader, Document
+from llama_index.vector_stores.faiss import DEFAULT_PERSIST_PATH
+from llama_index.vector_stores.simple import DEFAULT_VECTOR_STORE, NAMESPACE_SEP
+from llama_index.vector_stores.types import DEFAULT_PERSIST_FNAME, VectorStoreQuery, VectorStoreQueryResult
+from llama_index import VectorStoreIndex
 from llama_index import StorageContext, load_index_from_storage
+from llama_index.chat_engine import CondenseQuestionChatEngine
+from llama_index.indices.vector_store.retrievers import VectorIndexRetriever
+from llama_index.ingestion import run_transformations
+from llama_index.query_engine import RetrieverQueryEngine
+from llama_index.schema import BaseNode, MetadataMode
+
+from bm25_index import BM25_FILE_NAME, BM25Index, HybridSearchOptions
+from document_loader import ParallelDocumentLoader
+from faiss_index_factory import (FaissIndexOptions, INDEX_TYPE_FLAT, INDEX_TYPE_HNSW,
+                                 apply_search_options, create_faiss_index, get_index_type, read_faiss_index)
+from index_manifest import IndexManifest, MANIFEST_FILE_NAME, list_dataset_files
+from node_postprocessors import (ContextPackingPostprocessor, CrossEncoderRerankPostprocessor,
+                                 LexicalFusionPostprocessor, SentenceCompressionPostprocessor)
+from sqlite_store import SQLiteDocumentStore, SQLiteIndexStore, SQLiteKVStore, SQLITE_STORE_FILE_NAME
+
+DOCSTORE_BACKEND_JSON = "json"
+DOCSTORE_BACKEND_SQLITE = "sqlite"
+
+
+class MutableFaissVectorStore(FaissVectorStore):
+    """
+    FaissVectorStore with explicit vector ids so vectors can be removed by id.
+
+    The stock store uses the vector position as id, which breaks as soon as a
+    vector is removed; here ids are assigned explicitly and never reused until
+    the index is compacted. Works with the flat, IVF and HNSW indexes created
+    by faiss_index_factory.
+
+    HNSW graphs do not support removal: removed vectors are tombstoned and
+    filtered out of searches, until rebuild drops them from the graph.
+    """
+
+    _next_id: Optional[int] = PrivateAttr(default=None)
+    _mmapped: bool = PrivateAttr(default=False)
+    # ids of removed vectors still in the HNSW graph
+    _tombstones: Optional[set] = PrivateAttr(default=None)
+    # search parameters excluding the tombstones, with the selectors they point to
+    _search_params: Any = PrivateAttr(default=None)
+    _selectors: Any = PrivateAttr(default=None)
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir, fs=None, mmap=False):
+        persist_path = cls.get_persist_path(persist_dir)
+        if not os.path.exists(persist_path):
+            raise ValueError(f"No existing {__name__} found at {persist_path}.")
+        vector_store = cls(faiss_index=read_faiss_index(persist_path, mmap=mmap))
+        vector_store._mmapped = mmap
+        return vector_store
+
+    @staticmethod
+    def get_persist_path(persist_dir):
+        return os.path.join(persist_dir, f"{DEFAULT_VECTOR_STORE}{NAMESPACE_SEP}{DEFAULT_PERSIST_FNAME}")
+
+    def load_in_memory(self, persist_dir, options):
+        # memory mapped indexes are read-only, they must be fully read before being modified
+        if self._mmapped:
+            self._faiss_index = read_faiss_index(self.get_persist_path(persist_dir))
+            # search knobs are not persisted with the index
+            apply_search_options(self._faiss_index, options)
+            self._mmapped = False
+
+    def persist(self, persist_path=DEFAULT_PERSIST_PATH, fs=None):
+        # write to a new file and rename it, so that indexes memory mapping the
+        # previous file keep reading consistent data
+        os.makedirs(os.path.dirname(persist_path), exist_ok=True)
+        tmp_path = persist_path + ".tmp"
+        faiss.write_index(self._faiss_index, tmp_path)
+        os.replace(tmp_path, persist_path)
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        if len(nodes) == 0:
+            return []
+        embeddings = np.array([node.get_embedding() for node in nodes], dtype="float32")
+        if self._next_id is None:
+            ids = self.ids()
+            self._next_id = int(ids.max()) + 1 if len(ids) > 0 else 0
+        ids = np.arange(self._next_id, self._next_id + len(nodes), dtype="int64")
+        self._faiss_index.add_with_ids(embeddings, ids)
+        self._next_id += len(nodes)
+        return [str(i) for i in ids]
+
+    def ids(self):
+        if hasattr(self._faiss_index, "id_map"):
+            return faiss.vector_to_array(self._faiss_index.id_map)
+        ivf_index = faiss.try_extract_index_ivf(self._faiss_index)
+        if ivf_index is not None:
+            invlists = ivf_index.invlists
+            ids = [faiss.rev_swig_ptr(invlists.get_ids(list_no), invlists.list_size(list_no)).copy()
+                   for list_no in range(ivf_index.nlist) if invlists.list_size(list_no) > 0]
+            return np.concatenate(ids) if ids else np.zeros(0, dtype="int64")
+        # plain index persisted by older versions, ids are positions
+        return np.arange(self._faiss_index.ntotal, dtype="int64")
+
+    def index_type(self):
+        return get_index_type(self._faiss_index)
+
+    def tombstones(self):
+        return self._tombstones or set()
+
+    def set_tombstones(self, ids):
+        self._tombstones = {int(i) for i in ids}
+        self._search_params = self._selectors = None
+        if len(self._tombstones) > 0:
+            inner_index = faiss.downcast_index(self._faiss_index.index)
+            batch = faiss.IDSelectorBatch(np.array(sorted(self._tombstones), dtype="int64"))
+            self._selectors = (batch, faiss.IDSelectorNot(batch))
+            self._search_params = faiss.SearchParametersHNSW(sel=self._selectors[1],
+                                                             efSearch=inner_index.hnsw.efSearch)
+
+    def remove_ids(self, ids, options):
+        if len(ids) == 0:
+            return
+        ids = np.array([int(i) for i in ids], dtype="int64")
+        if self.index_type() == INDEX_TYPE_HNSW:
+            self.set_tombstones(self.tombstones().union(ids.tolist()))
+        else:
+            self._faiss_index.remove_ids(ids)
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if self._search_params is None:
+            return super().query(query, **kwargs)
+        if query.filters is not None:
+            raise ValueError("Metadata filters not implemented for Faiss yet.")
+        query_embedding = np.array(query.query_embedding, dtype="float32")[np.newaxis, :]
+        dists, indices = self._faiss_index.search(query_embedding, query.similarity_top_k,
+                                                  params=self._search_params)
+        results = [(float(dist), str(idx)) for dist, idx in zip(dists[0], indices[0]) if idx >= 0]
+        return VectorStoreQueryResult(similarities=[dist for dist, _ in results],
+                                      ids=[idx for _, idx in results])
+
+    def rebuild(self, index_type, options, renumber=False):
+        """
+        Rebuild the faiss index as index_type, training it on the current
+        vectors when needed. With renumber, ids are made contiguous again.
+
+        Returns:
+            dict mapping the previous string ids to the new ones; tombstoned
+            ids are dropped.
+        """
+        old_ids = np.setdiff1d(self.ids(), np.array(sorted(self.tombstones()), dtype="int64"))
+        new_ids = np.arange(len(old_ids), dtype="int64") if renumber else old_ids
+        self._rebuild(index_type, options, old_ids, new_ids)
+        return {str(old_id): str(new_id) for old_id, new_id in zip(old_ids, new_ids)}
+
+    def _rebuild(self, index_type, options, old_ids, new_ids):
+        if len(old_ids) > 0:
+            vectors = np.vstack([self._faiss_index.reconstruct(int(i)) for i in old_ids])
+        else:
+            vectors = np.zeros((0, self._faiss_index.d), dtype="float32")
+        rebuilt = create_faiss_index(index_type, self._faiss_index.d, options, training_vectors=vectors)
+        if len(new_ids) > 0:
+            rebuilt.add_with_ids(vectors, new_ids)
+        self._faiss_index = rebuilt
+        self._next_id = int(new_ids.max()) + 1 if len(new_ids) > 0 else 0
+        self.set_tombstones([])
+
+
+class LockedVectorIndexRetriever(VectorIndexRetriever):
+    """
+    VectorIndexRetriever searching the index and reading the found nodes
+    under lock, so that updates applied to the index being served are never
+    seen half done. The query is embedded before taking the lock.
+
+    The retriever keeps its FaissEmbeddingStorage alive, so that the SQLite
+    connection of the storage stays open while engines built on it are used.
+    """
+
+    def __init__(self, storage, **kwargs: Any):
+        super().__init__(storage.index, **kwargs)
+        self._storage = storage
+        self._lock = storage.lock
+
+    def _get_nodes_with_embeddings(self, query_bundle_with_embeddings):
+        with self._lock:
+            return super()._get_nodes_with_embeddings(query_bundle_with_embeddings)
+
+    async def _aget_nodes_with_embeddings(self, query_bundle_with_embeddings):
+        # FAISS searches are blocking, keep the lock wait off the event loop
+        return await asyncio.to_thread(self._get_nodes_with_embeddings, query_bundle_with_embeddings)
 
 
 class FaissEmbeddingStorage:
-    def __init__(self, data_dir, dimension):
+    def __init__(self, data_dir, dimension, compaction_threshold=0.2, document_loader=None,
+                 embedding_engine=None, embedding_cache=None, index_options=None,
+                 docstore_backend=DOCSTORE_BACKEND_JSON, persist_dir=None, progress_callback=None,
+                 hybrid_options=None, reranker=None, rerank_candidates=12, context_reserved_tokens=None,
+                 adaptive_top_k=None, compression_ratio=None):
         self.d = dimension
         self.data_dir = data_dir
+        self.document_loader = document_loader or ParallelDocumentLoader()
+        # when None, llama_index embeds the nodes with the service context model
+        self.embedding_engine = embedding_engine
+        self.embedding_cache = embedding_cache
+        self.index_options = index_options or FaissIndexOptions()
+        self.docstore_backend = docstore_backend
         self.engine = None
-        self.persist_dir = f"{self.data_dir}_vector_embedding"
+        # persist_dir differs from the default one for builds in a staging directory
+        self.persist_dir = persist_dir or self.default_persist_dir(data_dir)
+        self.compaction_threshold = compaction_threshold
+        self.manifest = IndexManifest(self.persist_dir)
+        # held by retrievals and by updates modifying the loaded index
+        self.lock = threading.Lock()
+        # node id -> FAISS id, built on first use and dropped when the index changes
+        self._vector_ids = None
+        # called with a message at each step of index updates
+        self.progress_callback = progress_callback
+        self.hybrid_options = hybrid_options or HybridSearchOptions()
+        # lexical index of the docstore nodes, kept in sync with the FAISS index
+        self.bm25 = None
+        if self.hybrid_options.enabled:
+            self.bm25 = BM25Index(self.persist_dir, k1=self.hybrid_options.bm25_k1, b=self.hybrid_options.bm25_b)
+        # optional CrossEncoderReranker narrowing rerank_candidates chunks down to similarity_top_k
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+        # when set, retrieved chunks are merged and packed in the context window
+        # minus these tokens kept for the prompt template and the answer
+        self.context_reserved_tokens = context_reserved_tokens
+        # optional AdaptiveTopKPostprocessor choosing how many chunks each question gets
+        self.adaptive_top_k = adaptive_top_k
+        # when set, only this share of the retrieved text, the sentences closest to the question, is kept
+        self.compression_ratio = compression_ratio
+
+    @staticmethod
+    def default_persist_dir(data_dir):
+        return f"{data_dir}_vector_embedding"
+
+    def _report_progress(self, message):
+        if self.progress_callback is not None:
+            self.progress_callback(message)
 
     def initialize_index(self, force_rewrite=False):
-        # Check if the persist directory exists and delete it if force_rewrite is true
-        if force_rewrite and os.path.exists(self.persist_dir):
+        # Without a manifest (index persisted by an older version) an incremental
+        # update is impossible, so force_rewrite falls back to a full rebuild.
+        if force_rewrite and os.path.exists(self.persist_dir) and not self.manifest.exists():
             print("Deleting existing directory for a fresh start.")
             self.delete_persist_dir()
 
         if os.path.exists(self.persist_dir) and os.listdir(self.persist_dir):
             print("Using the persisted value form " + self.persist_dir)
-            vector_store = FaissVectorStore.from_persist_dir(self.persist_dir)
-            storage_context = StorageContext.from_defaults(
-                vector_store=vector_store, persist_dir=self.persist_dir
-            )
+            # faiss.read_index restores the persisted index type, only the search knobs come from the config
+            vector_store = MutableFaissVectorStore.from_persist_dir(self.persist_dir,
+                                                                   mmap=self.index_options.mmap)
+            apply_search_options(vector_store.client, self.index_options)
+            storage_context = self._create_storage_context(vector_store, load=True)
             self.index = load_index_from_storage(storage_context=storage_context)
+            if vector_store.index_type() == INDEX_TYPE_HNSW:
+                # vectors removed since the last compaction are still in the graph
+                vector_ids = np.array([int(i) for i in self.index.index_struct.nodes_dict], dtype="int64")
+                vector_store.set_tombstones(np.setdiff1d(vector_store.ids(), vector_ids))
+            if self.manifest.exists():
+                self.manifest.load()
+            if self.bm25 is not None:
+                self._load_bm25_index()
+            if self.manifest.exists() and force_rewrite:
+                self.update_index()
         else:
             print("Generating new values")
-            torch.cuda.empty_cache()
-            gc.collect()
-            if os.path.exists(self.data_dir) and os.listdir(self.data_dir):
-                file_metadata = lambda x: {"filename": x}
-                documents = SimpleDirectoryReader(self.data_dir, file_metadata=file_metadata,
-                                                  recursive=True, required_exts= [".pdf", ".doc", ".docx", ".txt", ".xml"]).load_data()
-            else:
+            if not (os.path.exists(self.data_dir) and os.listdir(self.data_dir)):
                 print("No files found in the directory. Initializing an empty index.")
-                documents = []
-            faiss_index = faiss.IndexFlatL2(self.d)
-            #faiss_index = faiss.IndexFlatIP(self.d)
-            vector_store = FaissVectorStore(faiss_index=faiss_index)
-            storage_context = StorageContext.from_defaults(vector_store=vector_store)
-            index = VectorStoreIndex.from_documents(documents, storage_context=storage_context ,show_progress = True)
-            index.storage_context.persist(persist_dir=self.persist_dir)
-            self.index = index
-            torch.cuda.empty_cache()
-            gc.collect()
+            # vectors are first added to a flat index, update_index converts it to the
+            # configured type once there is something to train on
+            faiss_index = create_faiss_index(INDEX_TYPE_FLAT, self.d, self.index_options)
+            vector_store = MutableFaissVectorStore(faiss_index=faiss_index)
+            storage_context = self._create_storage_context(vector_store, load=False)
+            self.index = VectorStoreIndex([], storage_context=storage_context)
+            self.update_index(persist_always=True)
+
+    def _load_bm25_index(self):
+        if self.bm25.exists():
+            try:
+                self.bm25.load()
+                return
+            except Exception as e:
+                print(f"Rebuilding the BM25 index of {self.persist_dir}: {e}")
+        # index persisted without lexical search, or by an incompatible version
+        print("Building the BM25 index of " + self.persist_dir)
+        docstore = self.index.docstore
+        for node_id in set(self.index.index_struct.nodes_dict.values()):
+            node = docstore.get_document(node_id, raise_error=False)
+            if node is not None:
+                self.bm25.add(node_id, node.get_content(metadata_mode=MetadataMode.EMBED))
+        self.bm25.save()
+
+    def _create_storage_context(self, vector_store, load):
+        """
+        Build the storage context holding the docstore and index store.
+
+        The sqlite backend is used when configured, or when the persisted index
+        already uses it. A JSON docstore persisted by a previous build is
+        imported into SQLite the first time the sqlite backend loads it.
+        """
+        db_path = os.path.join(self.persist_dir, SQLITE_STORE_FILE_NAME)
+        if self.docstore_backend != DOCSTORE_BACKEND_SQLITE and not (load and os.path.exists(db_path)):
+            if load:
+                return StorageContext.from_defaults(vector_store=vector_store, persist_dir=self.persist_dir)
+            return StorageContext.from_defaults(vector_store=vector_store)
+
+        json_paths = [os.path.join(self.persist_dir, file_name) for file_name in ["docstore.json", "index_store.json"]]
+        migrate = load and not os.path.exists(db_path)
+        kvstore = SQLiteKVStore(db_path)
+        # closed once the storage, and every engine built on it, is released
+        weakref.finalize(self, kvstore.close)
+        if migrate:
+            print("Importing the JSON docstore of " + self.persist_dir + " into SQLite")
+            for json_path in json_paths:
+                kvstore.import_json(json_path)
+            kvstore.persist()
+            for json_path in json_paths:
+                os.remove(json_path)
+        return StorageContext.from_defaults(vector_store=vector_store,
+                                            docstore=SQLiteDocumentStore(kvstore),
+                                            index_store=SQLiteIndexStore(kvstore))
+
+    def update_index(self, persist_always=False):
+        """
+        Bring the index in line with the dataset directory.
+
+        Only files that were added or modified since the last update are parsed
+        and embedded; vectors and docstore nodes of removed or modified files
+        are deleted. Parsing and embedding run before taking the lock, so the
+        index keeps answering while it is updated in place.
+
+        Returns:
+            The files that were added, modified or removed, empty if the index
+            was up to date.
+        """
+        added, changed, removed = self.manifest.diff(list_dataset_files(self.data_dir))
+        if not (added or changed or removed):
+            print("Index is up to date with " + self.data_dir)
+            if persist_always:
+                self.persist()
+            else:
+                self.manifest.save()
+            return []
+
+        print(f"Updating index: {len(added)} added, {len(changed)} changed, {len(removed)} removed files")
+        self._report_progress(f"Indexing {len(added) + len(changed)} files, removing {len(changed) + len(removed)}")
+        torch.cuda.empty_cache()
+        gc.collect()
+        file_paths = sorted(added + changed)
+        nodes, doc_ids, node_ids = self._parse_files(file_paths)
+        with self.lock:
+            self.index.vector_store.load_in_memory(self.persist_dir, self.index_options)
+            self._remove_files(changed + removed)
+            self._insert_nodes(nodes)
+            # files without any extracted text are recorded too, so they are not
+            # re-parsed; files that could not be parsed are retried on the next update
+            for file_path in doc_ids:
+                self.manifest.record(file_path, doc_ids[file_path], node_ids[file_path])
+            vector_count = self.index.vector_store.client.ntotal - len(self.index.vector_store.tombstones())
+            index_type = self.index_options.resolve_index_type(vector_count)
+            if self.manifest.deleted_since_compaction > self.compaction_threshold * max(vector_count, 1):
+                self.compact_index(index_type)
+            elif self.index.vector_store.index_type() != index_type:
+                print(f"Converting index to {index_type} for {vector_count} vectors")
+                self.index.vector_store.rebuild(index_type, self.index_options)
+            self._vector_ids = None
+        self._report_progress("Saving the index")
+        self.persist()
+        torch.cuda.empty_cache()
+        gc.collect()
+        return sorted(added + changed + removed)
+
+    def _parse_files(self, file_paths):
+        """
+        Returns:
+            (nodes, doc_ids, node_ids): the embedded nodes of file_paths, and
+            the document and node ids of each file that could be parsed.
+        """
+        documents = []
+        doc_ids = {}
+        for file_path, file_documents in self.document_loader.load(file_paths):
+            documents.extend(file_documents)
+            doc_ids[file_path] = [document.doc_id for document in file_documents]
+        nodes = run_transformations(documents, self.index.service_context.transformations,
+                                    show_progress=True)
+        self._report_progress(f"Embedding {len(nodes)} chunks from {len(file_paths)} files")
+
+        node_ids = defaultdict(list)
+        for node in nodes:
+            node_ids[node.metadata["filename"]].append(node.node_id)
+
+        self._embed_nodes(nodes)
+        return nodes, doc_ids, node_ids
+
+    def _insert_nodes(self, nodes):
+        self.index.insert_nodes(nodes)
+        if self.bm25 is not None:
+            for node in nodes:
+                self.bm25.add(node.node_id, node.get_content(metadata_mode=MetadataMode.EMBED))
+
+    def _embed_nodes(self, nodes):
+        if self.embedding_cache is not None:
+            texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+            for node, embedding in zip(nodes, self.embedding_cache.get_many(texts)):
+                if embedding is not None:
+                    node.embedding = embedding.tolist()
+            missing = [node for node in nodes if node.embedding is None]
+            print(f"Embedding cache: {len(nodes) - len(missing)} hits, {len(missing)} misses")
+        else:
+            missing = nodes
+
+        if self.embedding_engine is not None:
+            self.embedding_engine.embed_nodes(missing)
+        elif self.embedding_cache is not None and len(missing) > 0:
+            embed_model = self.index.service_context.embed_model
+            embeddings = embed_model.get_text_embedding_batch(
+                [node.get_content(metadata_mode=MetadataMode.EMBED) for node in missing], show_progress=True)
+            for node, embedding in zip(missing, embeddings):
+                node.embedding = embedding
+
+        if self.embedding_cache is not None and len(missing) > 0:
+            self.embedding_cache.put_many([node.get_content(metadata_mode=MetadataMode.EMBED) for node in missing],
+                                          [node.embedding for node in missing])
+            self.embedding_cache.flush()
+
+    def _remove_files(self, file_paths):
+        node_ids, doc_ids = set(), []
+        for file_path in file_paths:
+            entry = self.manifest.forget(file_path)
+            if entry is not None:
+                node_ids.update(entry["node_ids"])
+                doc_ids.extend(entry["doc_ids"])
+        if len(node_ids) == 0:
+            return
+
+        index_struct = self.index.index_struct
+        vector_ids = [vector_id for vector_id, node_id in index_struct.nodes_dict.items() if node_id in node_ids]
+        self.index.vector_store.remove_ids(vector_ids, self.index_options)
+        for vector_id in vector_ids:
+            index_struct.delete(vector_id)
+        docstore = self.index.docstore
+        for node_id in node_ids:
+            docstore.delete_document(node_id, raise_error=False)
+        for doc_id in doc_ids:
+            docstore.delete_ref_doc(doc_id, raise_error=False)
+        if self.bm25 is not None:
+            self.bm25.remove(node_ids)
+        self.index.storage_context.index_store.add_index_struct(index_struct)
+        self.manifest.deleted_since_compaction += len(vector_ids)
+
+    def compact_index(self, index_type=None):
+        print("Compacting index " + self.persist_dir)
+        if index_type is None:
+            index_type = self.index.vector_store.index_type()
+        id_mapping = self.index.vector_store.rebuild(index_type, self.index_options, renumber=True)
+        index_struct = self.index.index_struct
+        index_struct.nodes_dict = {id_mapping[vector_id]: node_id
+                                   for vector_id, node_id in index_struct.nodes_dict.items()
+                                   if vector_id in id_mapping}
+        self.index.storage_context.index_store.add_index_struct(index_struct)
+        self.manifest.deleted_since_compaction = 0
+
+    def persist(self):
+        # files still hard linked with the served index by build_in_staging must
+        # not be written in place, like llama_index does with its JSON stores;
+        # their content is loaded, they are all written anew below
+        if os.path.isdir(self.persist_dir):
+            for file_name in os.listdir(self.persist_dir):
+                path = os.path.join(self.persist_dir, file_name)
+                if os.path.isfile(path) and os.stat(path).st_nlink > 1:
+                    os.remove(path)
+        self.index.storage_context.persist(persist_dir=self.persist_dir)
+        if self.bm25 is not None:
+            self.bm25.save()
+        self.manifest.save()
+
+    def relocate(self, persist_dir):
+        """Point the storage at persist_dir once its persisted files were moved there."""
+        self.persist_dir = persist_dir
+        self.manifest.path = os.path.join(persist_dir, MANIFEST_FILE_NAME)
+        if self.bm25 is not None:
+            self.bm25.path = os.path.join(persist_dir, BM25_FILE_NAME)
+        docstore = self.index.storage_context.docstore
+        if isinstance(docstore, SQLiteDocumentStore):
+            docstore._kvstore.reopen(os.path.join(persist_dir, SQLITE_STORE_FILE_NAME))
+
+    def node_embeddings(self, node_ids):
+        """
+        Embeddings of docstore nodes read back from the FAISS index, None for
+        nodes it cannot reconstruct. Called with the lock held.
+        """
+        if self._vector_ids is None:
+            self._vector_ids = {node_id: int(vector_id)
+                                for vector_id, node_id in self.index.index_struct.nodes_dict.items()}
+        faiss_index = self.index.vector_store.client
+        embeddings = []
+        for node_id in node_ids:
+            embedding = None
+            if node_id in self._vector_ids:
+                try:
+                    embedding = faiss_index.reconstruct(self._vector_ids[node_id])
+                except RuntimeError:
+                    # e.g. IVF index persisted without direct map
+                    pass
+            embeddings.append(embedding)
+        return embeddings
+
+    def memory_usage(self):
+        """Rough estimate of the memory held by the loaded index, in bytes."""
+        faiss_index = self.index.vector_store.client
+        # vectors and their ids, plus the level 0 links of HNSW graphs
+        memory = faiss_index.ntotal * (self.d * 4 + 8)
+        if self.index.vector_store.index_type() == INDEX_TYPE_HNSW:
+            memory += faiss_index.ntotal * self.index_options.hnsw_m * 2 * 4
+        # the JSON docstore is held in memory, the SQLite one is read on demand
+        docstore_path = os.path.join(self.persist_dir, "docstore.json")
+        if os.path.exists(docstore_path):
+            memory += os.path.getsize(docstore_path)
+        if self.bm25 is not None:
+            memory += self.bm25.memory_usage()
+        return memory
 
     def delete_persist_dir(self):
         if os.path.exists(self.persist_dir) and os.path.isdir(self.persist_dir):
@@ -76,18 +556,57 @@ class FaissEmbeddingStorage:
             except Exception as e:
                 print(f"Error occurred while deleting directory: {str(e)}")
 
-    def get_engine(self,is_chat_engine ,streaming , similarity_top_k):
+    def get_engine(self,is_chat_engine ,streaming , similarity_top_k, service_context=None):
+        # engines built with another service context than the index's, e.g. after
+        # a LLM change, share the loaded index and only differ in their synthesizer
+        service_context = service_context or self.index.service_context
+        # each stage over-retrieves for the next one, down to similarity_top_k chunks
+        node_postprocessors = []
+        if self.adaptive_top_k is not None:
+            node_postprocessors.append(self.adaptive_top_k)
+            similarity_top_k = max(similarity_top_k, self.adaptive_top_k.max_k)
+        if self.reranker is not None:
+            node_postprocessors.insert(0, CrossEncoderRerankPostprocessor(reranker=self.reranker,
+                                                                       top_n=similarity_top_k))
+            similarity_top_k = max(similarity_top_k, self.rerank_candidates)
+        if self.bm25 is not None:
+            # FAISS candidates are fused with the BM25 ones
+            node_postprocessors.insert(0, LexicalFusionPostprocessor(bm25=self.bm25, docstore=self.index.docstore,
+                                                                     embed_model=service_context.embed_model,
+                                                                     node_embeddings=self.node_embeddings,
+                                                                     lock=self.lock,
+                                                                     top_k=similarity_top_k,
+                                                                     candidates=self.hybrid_options.candidates,
+                                                                     rrf_k=self.hybrid_options.rrf_k))
+            similarity_top_k = max(similarity_top_k, self.hybrid_options.candidates)
+        if self.context_reserved_tokens is not None:
+            # the budget follows the context window of the selected model
+            context_window = service_context.prompt_helper.context_window
+            node_postprocessors.append(ContextPackingPostprocessor(
+                token_budget=context_window - self.context_reserved_tokens))
+        if self.compression_ratio is not None:
+            # after packing, which merges chunks by their character offsets
+            node_postprocessors.append(SentenceCompressionPostprocessor(embed_model=service_context.embed_model,
+                                                                        ratio=self.compression_ratio))
+        # same engines as index.as_query_engine and as_chat_engine, with a
+        # retriever that waits for the updates of the index
+        retriever = LockedVectorIndexRetriever(
+            self,
+            similarity_top_k=similarity_top_k,
+            callback_manager=self.index.service_context.callback_manager
+        )
+        query_engine = RetrieverQueryEngine.from_args(
+            retriever=retriever,
+            service_context=service_context,
+            streaming=streaming,
+            node_postprocessors=node_postprocessors
+        )
         if is_chat_engine == True:
-            self.engine = self.index.as_chat_engine(
-                chat_mode="condense_question",
-                streaming=streaming,
-                similarity_top_k = similarity_top_k
+            self.engine = CondenseQuestionChatEngine.from_defaults(
+                query_engine=query_engine,
+                service_context=service_context
             )
         else:
-            query_engine = self.index.as_query_engine(
-                streaming=streaming,
-                similarity_top_k = similarity_top_k,
-            )
             self.engine = query_engine
         return self.engine
 
@@ -0,0 +1,161 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+import os
+import shutil
+import threading
+import traceback
+
+from sqlite_store import SQLITE_STORE_FILE_NAME
+
+STAGING_SUFFIX = ".staging"
+RETIRED_SUFFIX = ".retired"
+# written in a staging directory once its index is complete
+STAGING_COMPLETE_FILE_NAME = "staging_complete"
+
+
+class BackgroundIndexBuilder:
+    """
+    Runs index builds one at a time in a background thread.
+
+    A build submitted while another one runs replaces any build still waiting,
+    since only the last requested dataset matters. The dataset files changed
+    according to the replaced builds are not lost though: builds are called
+    with the set of changed files of all the builds they replaced, in
+    addition to their own. Progress messages reported by the builds are
+    exposed by status() for the UI.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = None
+        self._thread = None
+        self._status = ""
+
+    def submit(self, description, build, changed_files=()):
+        changed_files = set(changed_files)
+        with self._lock:
+            if self._pending is not None:
+                changed_files |= self._pending[2]
+            self._pending = (description, build, changed_files)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def report(self, message):
+        print(message)
+        self._status = message
+
+    def status(self):
+        return self._status
+
+    def is_building(self):
+        with self._lock:
+            return self._thread is not None
+
+    def _run(self):
+        while True:
+            with self._lock:
+                job = self._pending
+                self._pending = None
+                if job is None:
+                    self._thread = None
+                    return
+            description, build, changed_files = job
+            self.report(description)
+            try:
+                self.report(build(changed_files) or "")
+            except Exception as e:
+                traceback.print_exc()
+                self.report(f"Index update failed: {e}")
+
+
+def index_exists(persist_dir):
+    return os.path.exists(persist_dir) and len(os.listdir(persist_dir)) > 0
+
+
+def link_or_copy(source, destination):
+    """
+    Hard link source at destination, so that staging an index does not copy
+    the files its update leaves unchanged. SQLite databases, which are
+    modified in place, and files of filesystems without hard links are copied.
+    """
+    if os.path.basename(source).startswith(SQLITE_STORE_FILE_NAME):
+        return shutil.copy2(source, destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+    return destination
+
+
+def build_in_staging(create_storage, persist_dir, force_rewrite=False):
+    """
+    Build or update the index of persist_dir in a staging copy, then move it in place.
+
+    The index being served keeps using persist_dir until the new one is ready.
+    On platforms that cannot rename a directory with open files, the staged
+    index keeps being used from the staging directory and is moved in place
+    by promote_staged_index() the next time the index is loaded.
+
+    Args:
+        create_storage: function returning a FaissEmbeddingStorage for a persist directory.
+
+    Returns:
+        the built storage.
+    """
+    staging_dir = persist_dir + STAGING_SUFFIX
+    if os.path.exists(staging_dir):
+        shutil.rmtree(staging_dir)
+    if index_exists(persist_dir):
+        # incremental updates start from the current index, whose files are
+        # shared until the storage persists new ones
+        shutil.copytree(persist_dir, staging_dir, copy_function=link_or_copy)
+    storage = create_storage(staging_dir)
+    storage.initialize_index(force_rewrite=force_rewrite)
+    open(os.path.join(staging_dir, STAGING_COMPLETE_FILE_NAME), 'w').close()
+    try:
+        promote_staged_index(persist_dir)
+        storage.relocate(persist_dir)
+    except OSError as e:
+        print(f"Unable to replace {persist_dir} while it is in use ({e}), it will be replaced on next load")
+    return storage
+
+
+def promote_staged_index(persist_dir):
+    """Move a complete staged index in place of persist_dir, if there is one."""
+    staging_dir = persist_dir + STAGING_SUFFIX
+    if not os.path.exists(os.path.join(staging_dir, STAGING_COMPLETE_FILE_NAME)):
+        return False
+    retired_dir = persist_dir + RETIRED_SUFFIX
+    if os.path.exists(retired_dir):
+        shutil.rmtree(retired_dir)
+    if os.path.exists(persist_dir):
+        os.rename(persist_dir, retired_dir)
+    try:
+        os.rename(staging_dir, persist_dir)
+    except OSError:
+        if os.path.exists(retired_dir):
+            os.rename(retired_dir, persist_dir)
+        raise
+    os.remove(os.path.join(persist_dir, STAGING_COMPLETE_FILE_NAME))
+    # files of the retired index may still be open by the engine it served
+    shutil.rmtree(retired_dir, ignore_errors=True)
+    return True
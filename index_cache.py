@@ -0,0 +1,92 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+import gc
+import os
+import threading
+from collections import OrderedDict
+
+
+class IndexCache:
+    """
+    Loaded FaissEmbeddingStorage instances keyed by dataset directory.
+
+    Switching back to a dataset used recently returns the storage already in
+    memory instead of reading the index from disk again. The least recently
+    used storages are dropped once their estimated memory use exceeds
+    max_memory_mb; the most recent one is always kept. Dropped storages
+    release their SQLite connection once no engine uses them anymore.
+    """
+
+    def __init__(self, max_memory_mb=2048):
+        self.max_memory = max_memory_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        # data directory -> (storage, estimated bytes), least recently used first
+        self._storages = OrderedDict()
+
+    @staticmethod
+    def _key(data_dir):
+        return os.path.normcase(os.path.abspath(data_dir))
+
+    def get(self, data_dir, load, refresh=None):
+        """
+        Returns:
+            the cached storage of data_dir, passed to refresh() first to catch
+            up with its dataset, or the one returned by load().
+        """
+        key = self._key(data_dir)
+        with self._lock:
+            cached = self._storages.get(key)
+            if cached is not None:
+                print("Using the index of " + data_dir + " already in memory")
+                self._storages.move_to_end(key)
+        if cached is not None:
+            if refresh is not None:
+                refresh(cached[0])
+            return cached[0]
+        storage = load()
+        with self._lock:
+            self._storages[key] = (storage, storage.memory_usage())
+            self._storages.move_to_end(key)
+            self._evict()
+        return storage
+
+    def update(self, data_dir):
+        """Refresh the memory estimate of a storage after its index changed."""
+        key = self._key(data_dir)
+        with self._lock:
+            if key in self._storages:
+                storage = self._storages[key][0]
+                self._storages[key] = (storage, storage.memory_usage())
+                self._evict()
+
+    def discard(self, data_dir):
+        with self._lock:
+            self._storages.pop(self._key(data_dir), None)
+
+    def _evict(self):
+        evicted = False
+        while len(self._storages) > 1 and sum(size for _, size in self._storages.values()) > self.max_memory:
+            key, _ = self._storages.popitem(last=False)
+            print("Releasing the index of " + key + " from memory")
+            evicted = True
+        if evicted:
+            # storages are part of reference cycles, collecting them closes their connection
+            gc.collect()
@@ -0,0 +1,131 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+import hashlib
+import json
+import os
+from pathlib import Path
+
+MANIFEST_FILE_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+SUPPORTED_EXTENSIONS = [".pdf", ".doc", ".docx", ".txt", ".xml"]
+
+
+def list_dataset_files(data_dir, required_exts=SUPPORTED_EXTENSIONS):
+    # same selection rules as SimpleDirectoryReader(recursive=True, required_exts=...)
+    if not os.path.isdir(data_dir):
+        return []
+    files = []
+    for ref in Path(data_dir).rglob("*"):
+        if ref.is_dir() or ref.suffix not in required_exts:
+            continue
+        relative_parts = ref.relative_to(data_dir).parts
+        if any(part.startswith(".") for part in relative_parts):
+            continue
+        files.append(str(ref))
+    return sorted(files)
+
+
+def file_sha256(file_path, block_size=1024 * 1024):
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class IndexManifest:
+    """
+    Per-file record of what has been embedded in a persisted index.
+
+    Each entry maps a dataset file path to its size, mtime, content hash and
+    the docstore document/node ids produced from it, so that a rebuild only
+    needs to parse and embed the files that were added or modified.
+    """
+
+    def __init__(self, persist_dir):
+        self.path = os.path.join(persist_dir, MANIFEST_FILE_NAME)
+        self.files = {}
+        self.deleted_since_compaction = 0
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        with open(self.path, 'r') as file:
+            data = json.load(file)
+        if data.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported manifest version in {self.path}")
+        self.files = data.get("files", {})
+        self.deleted_since_compaction = data.get("deleted_since_compaction", 0)
+        return self
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        data = {
+            "version": MANIFEST_VERSION,
+            "deleted_since_compaction": self.deleted_since_compaction,
+            "files": self.files
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(data, file, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def diff(self, file_paths):
+        """
+        Compare the manifest against the files currently in the dataset.
+
+        Returns:
+            (added, changed, removed) lists of file paths. Files whose size or
+            mtime moved but whose content hash is unchanged are refreshed in
+            place and not reported.
+        """
+        added, changed = [], []
+        for file_path in file_paths:
+            stat = os.stat(file_path)
+            entry = self.files.get(file_path)
+            if entry is None:
+                added.append(file_path)
+                continue
+            if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                continue
+            if entry["sha256"] == file_sha256(file_path):
+                entry["size"] = stat.st_size
+                entry["mtime"] = stat.st_mtime
+                continue
+            changed.append(file_path)
+
+        current = set(file_paths)
+        removed = [file_path for file_path in self.files if file_path not in current]
+        return added, changed, removed
+
+    def record(self, file_path, doc_ids, node_ids):
+        stat = os.stat(file_path)
+        self.files[file_path] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": file_sha256(file_path),
+            "doc_ids": list(doc_ids),
+            "node_ids": list(node_ids)
+        }
+
+    def forget(self, file_path):
+        return self.files.pop(file_path, None)
@@ -0,0 +1,338 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+from collections import defaultdict
+from typing import Any, List, Optional
+
+import numpy as np
+
+from llama_index.bridge.pydantic import Field, PrivateAttr
+from llama_index.node_parser.text.utils import split_by_sentence_tokenizer
+from llama_index.postprocessor.types import BaseNodePostprocessor
+from llama_index.schema import BaseNode, MetadataMode, NodeWithScore, QueryBundle, TextNode
+from llama_index.utils import get_tokenizer
+
+
+def l2_scores(query_embedding, embeddings):
+    # same measure as the scores of the FAISS L2 indexes: squared distance
+    difference = np.asarray(embeddings, dtype="float32") - np.asarray(query_embedding, dtype="float32")
+    return np.sum(difference * difference, axis=1)
+
+
+class LexicalFusionPostprocessor(BaseNodePostprocessor):
+    """
+    Fuse the chunks retrieved from FAISS with the best BM25 matches of the query.
+
+    Both rankings are combined by reciprocal rank fusion and the top_k first
+    chunks are kept, so that exact terms like part numbers or error codes
+    reach the prompt without raising similarity_top_k. Chunks only found by
+    BM25 get the L2 distance of their embedding to the query as score, like
+    the FAISS ones, so the score threshold still applies to them. Their
+    embeddings are read back from the FAISS index by node_embeddings, and
+    only computed for chunks it has no vector for.
+    """
+
+    top_k: int = Field(description="Number of chunks kept.")
+    candidates: int = Field(default=20, description="Number of BM25 matches fused.")
+    rrf_k: int = Field(default=60, description="Rank offset of reciprocal rank fusion.")
+
+    _bm25: Any = PrivateAttr()
+    _docstore: Any = PrivateAttr()
+    _embed_model: Any = PrivateAttr()
+    _node_embeddings: Any = PrivateAttr()
+    _lock: Any = PrivateAttr()
+
+    def __init__(self, bm25, docstore, embed_model, node_embeddings, lock, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._bm25 = bm25
+        self._docstore = docstore
+        self._embed_model = embed_model
+        self._node_embeddings = node_embeddings
+        # lock of the index updates, which modify the BM25 index and the docstore
+        self._lock = lock
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LexicalFusionPostprocessor"
+
+    def _postprocess_nodes(self, nodes: List[NodeWithScore],
+                           query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+        if query_bundle is None:
+            return nodes[:self.top_k]
+        fused_scores = defaultdict(float)
+        for rank, node in enumerate(nodes):
+            fused_scores[node.node.node_id] += 1 / (self.rrf_k + rank + 1)
+        retrieved = {node.node.node_id: node for node in nodes}
+        with self._lock:
+            for rank, (node_id, _) in enumerate(self._bm25.search(query_bundle.query_str, self.candidates)):
+                fused_scores[node_id] += 1 / (self.rrf_k + rank + 1)
+            selected = sorted(fused_scores, key=fused_scores.get, reverse=True)[:self.top_k]
+            # FAISS chunks removed by an update since their retrieval may be gone
+            lexical_nodes = [self._docstore.get_document(node_id, raise_error=False)
+                             for node_id in selected if node_id not in retrieved]
+            lexical_nodes = [node for node in lexical_nodes if isinstance(node, BaseNode)]
+            embeddings = self._node_embeddings([node.node_id for node in lexical_nodes])
+        if len(lexical_nodes) > 0:
+            if query_bundle.embedding is None:
+                query_bundle.embedding = self._embed_model.get_agg_embedding_from_queries(
+                    query_bundle.embedding_strs)
+            missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+            if len(missing) > 0:
+                computed = self._embed_model.get_text_embedding_batch(
+                    [lexical_nodes[i].get_content(metadata_mode=MetadataMode.EMBED) for i in missing])
+                for i, embedding in zip(missing, computed):
+                    embeddings[i] = embedding
+            for node, score in zip(lexical_nodes, l2_scores(query_bundle.embedding, embeddings)):
+                retrieved[node.node_id] = NodeWithScore(node=node, score=float(score))
+        return [retrieved[node_id] for node_id in selected if node_id in retrieved]
+
+
+class CrossEncoderRerankPostprocessor(BaseNodePostprocessor):
+    """
+    Keep the top_n chunks according to a CrossEncoderReranker.
+
+    The chunks keep their retrieval score, so the score threshold and the
+    references are unchanged; only their selection and order come from the
+    cross-encoder.
+    """
+
+    top_n: int = Field(description="Number of chunks kept.")
+
+    _reranker: Any = PrivateAttr()
+
+    def __init__(self, reranker, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._reranker = reranker
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CrossEncoderRerankPostprocessor"
+
+    def _postprocess_nodes(self, nodes: List[NodeWithScore],
+                           query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+        if query_bundle is None or len(nodes) <= 1:
+            return nodes[:self.top_n]
+        scores = self._reranker.score(query_bundle.query_str,
+                                      [node.node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes])
+        order = sorted(range(len(nodes)), key=lambda i: scores[i], reverse=True)
+        return [nodes[i] for i in order[:self.top_n]]
+
+
+class AdaptiveTopKPostprocessor(BaseNodePostprocessor):
+    """
+    Keep between min_k and max_k chunks depending on the distribution of their L2 scores.
+
+    Chunks scoring above max_score are dropped, then the sorted scores are
+    cut at their largest gap when it reaches min_gap. A clear best match is
+    sent alone, while a question with many comparable hits keeps them all.
+    The chunks keep the order of the previous stages.
+    """
+
+    min_k: int = Field(default=1, description="Minimum number of chunks kept.")
+    max_k: int = Field(default=4, description="Maximum number of chunks kept.")
+    max_score: float = Field(default=1.5, description="L2 score above which chunks are dropped.")
+    min_gap: float = Field(default=0.15, description="Score gap between two chunks that cuts the list.")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "AdaptiveTopKPostprocessor"
+
+    def _cutoff(self, scores):
+        # lower L2 scores are better
+        scores = sorted(scores)[:self.max_k]
+        k = len(scores)
+        while k > self.min_k and scores[k - 1] > self.max_score:
+            k -= 1
+        gaps = [(scores[i] - scores[i - 1], i) for i in range(max(self.min_k, 1), k)]
+        if len(gaps) > 0:
+            gap, i = max(gaps)
+            if gap >= self.min_gap:
+                k = i
+        return scores[k - 1]
+
+    def _postprocess_nodes(self, nodes: List[NodeWithScore],
+                           query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+        scores = [node.score for node in nodes if node.score is not None]
+        if len(scores) == 0:
+            return nodes[:self.max_k]
+        cutoff = self._cutoff(scores)
+        return [node for node in nodes if node.score is None or node.score <= cutoff][:self.max_k]
+
+
+class ContextPackingPostprocessor(BaseNodePostprocessor):
+    """
+    Merge overlapping or adjacent chunks of the same document and fit them in a token budget.
+
+    Chunks are split with an overlap, so neighbouring chunks retrieved
+    together repeat part of their text in the prompt. Chunks of a document
+    whose character ranges overlap or touch are merged into one, chunks
+    contained in another or repeating the same text are dropped, and the
+    results are kept in retrieval order while they fit in token_budget
+    minus the question tokens. The first one is always kept.
+    """
+
+    token_budget: int = Field(description="Tokens available for the retrieved context and the question.")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ContextPackingPostprocessor"
+
+    @staticmethod
+    def _merge(unit, node, rank):
+        # merge node into unit when it starts inside or right after it and
+        # their texts agree on the shared range, offsets coming from str.find
+        text = node.node.get_content(metadata_mode=MetadataMode.NONE)
+        start, end = node.node.start_char_idx, node.node.end_char_idx
+        if start > unit["end"]:
+            return False
+        shared = unit["text"][start - unit["start"]:min(end, unit["end"]) - unit["start"]]
+        if shared != text[:len(shared)]:
+            return False
+        if end > unit["end"]:
+            unit["text"] += text[unit["end"] - start:]
+            unit["end"] = end
+        unit["nodes"].append(node)
+        unit["rank"] = min(unit["rank"], rank)
+        return True
+
+    @staticmethod
+    def _unit_node(unit):
+        nodes = unit["nodes"]
+        if len(nodes) == 1:
+            return nodes[0]
+        first = nodes[0].node
+        scores = [node.score for node in nodes if node.score is not None]
+        merged = TextNode(text=unit["text"], metadata=dict(first.metadata),
+                          excluded_embed_metadata_keys=list(first.excluded_embed_metadata_keys),
+                          excluded_llm_metadata_keys=list(first.excluded_llm_metadata_keys),
+                          relationships=dict(first.relationships),
+                          start_char_idx=unit["start"], end_char_idx=unit["end"])
+        return NodeWithScore(node=merged, score=min(scores) if scores else None)
+
+    def _postprocess_nodes(self, nodes: List[NodeWithScore],
+                           query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+        units = []
+        by_document = defaultdict(list)
+        for rank, node in enumerate(nodes):
+            if node.node.ref_doc_id is not None and node.node.start_char_idx is not None \
+                    and node.node.end_char_idx is not None:
+                by_document[node.node.ref_doc_id].append((rank, node))
+            else:
+                units.append({"nodes": [node], "rank": rank})
+        for document_nodes in by_document.values():
+            unit = None
+            for rank, node in sorted(document_nodes, key=lambda item: item[1].node.start_char_idx):
+                if unit is None or not self._merge(unit, node, rank):
+                    unit = {"nodes": [node], "rank": rank,
+                            "text": node.node.get_content(metadata_mode=MetadataMode.NONE),
+                            "start": node.node.start_char_idx, "end": node.node.end_char_idx}
+                    units.append(unit)
+
+        tokenizer = get_tokenizer()
+        budget = self.token_budget - (len(tokenizer(query_bundle.query_str)) if query_bundle is not None else 0)
+        packed = []
+        seen_texts = set()
+        for unit in sorted(units, key=lambda unit: unit["rank"]):
+            node = self._unit_node(unit)
+            content = node.node.get_content(metadata_mode=MetadataMode.NONE)
+            if content in seen_texts:
+                continue
+            tokens = len(tokenizer(node.node.get_content(metadata_mode=MetadataMode.LLM)))
+            if tokens > budget and len(packed) > 0:
+                continue
+            seen_texts.add(content)
+            packed.append(node)
+            budget -= tokens
+        return packed
+
+
+class SentenceCompressionPostprocessor(BaseNodePostprocessor):
+    """
+    Keep the sentences of the retrieved chunks closest to the question.
+
+    Every sentence is embedded in one batched call of the embedding model and
+    ranked by cosine similarity with the question; the best ones are kept,
+    in their original order, until ratio of the retrieved text is reached.
+    Each chunk keeps at least its best sentence and all its metadata, so
+    the references are unchanged.
+    """
+
+    ratio: float = Field(default=0.5, description="Share of the retrieved characters kept.")
+
+    _embed_model: Any = PrivateAttr()
+    _split: Any = PrivateAttr()
+
+    def __init__(self, embed_model, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._embed_model = embed_model
+        self._split = split_by_sentence_tokenizer()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "SentenceCompressionPostprocessor"
+
+    def _postprocess_nodes(self, nodes: List[NodeWithScore],
+                           query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+        if query_bundle is None or len(nodes) == 0:
+            return nodes
+        # (node position, sentence) of every compressible sentence, in text order
+        sentences = []
+        for position, node in enumerate(nodes):
+            if isinstance(node.node, TextNode):
+                sentences.extend((position, sentence) for sentence in
+                                 self._split(node.node.get_content(metadata_mode=MetadataMode.NONE))
+                                 if sentence.strip())
+        if len(sentences) <= len(nodes):
+            return nodes
+
+        if query_bundle.embedding is None:
+            query_bundle.embedding = self._embed_model.get_agg_embedding_from_queries(query_bundle.embedding_strs)
+        embeddings = np.asarray(
+            self._embed_model.get_text_embedding_batch([sentence for _, sentence in sentences]), dtype="float32")
+        query_embedding = np.asarray(query_bundle.embedding, dtype="float32")
+        similarities = embeddings @ query_embedding / np.maximum(
+            np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query_embedding), 1e-12)
+
+        budget = self.ratio * sum(len(sentence) for _, sentence in sentences)
+        kept = set()
+        best_of_node = set()
+        for index in np.argsort(-similarities):
+            position, sentence = sentences[index]
+            if position not in best_of_node:
+                best_of_node.add(position)
+            elif budget < len(sentence):
+                continue
+            kept.add(index)
+            budget -= len(sentence)
+
+        kept_sentences = defaultdict(list)
+        for index in sorted(kept):
+            position, sentence = sentences[index]
+            kept_sentences[position].append(sentence)
+        compressed = []
+        for position, node in enumerate(nodes):
+            if position not in kept_sentences:
+                compressed.append(node)
+                continue
+            # offsets no longer describe the text once sentences are removed
+            compressed_node = node.node.copy(update={"text": "".join(kept_sentences[position]).strip(),
+                                                     "start_char_idx": None, "end_char_idx": None})
+            compressed.append(NodeWithScore(node=compressed_node, score=node.score))
+        return compressed
@@ -0,0 +1,318 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+import asyncio
+import json
+import weakref
+from typing import Any, Optional, Sequence, Union
+
+import httpx
+from httpx import Timeout
+
+from llama_index.bridge.pydantic import Field
+from llama_index.core.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    MessageRole,
+)
+from llama_index.llms.base import llm_chat_callback, llm_completion_callback
+from llama_index.llms.ollama import Ollama, get_addtional_kwargs
+
+# connections to Ollama are kept open and shared by every AsyncOllama instance
+HTTP_POOL_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=300)
+
+_http_client = None
+# httpx.AsyncClient cannot be shared between event loops
+_async_http_clients = weakref.WeakKeyDictionary()
+
+
+def get_http_client():
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.Client(limits=HTTP_POOL_LIMITS)
+    return _http_client
+
+
+def get_async_http_client():
+    loop = asyncio.get_running_loop()
+    client = _async_http_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(limits=HTTP_POOL_LIMITS)
+        _async_http_clients[loop] = client
+    return client
+
+
+def _chat_response(raw, message, content, delta=None):
+    return ChatResponse(
+        message=ChatMessage(
+            content=content,
+            role=MessageRole(message.get("role")),
+            additional_kwargs=get_addtional_kwargs(message, ("content", "role")),
+        ),
+        delta=delta,
+        raw=raw,
+        additional_kwargs=get_addtional_kwargs(raw, ("message",)),
+    )
+
+
+def _completion_response(raw, text, delta=None):
+    return CompletionResponse(
+        text=text,
+        delta=delta,
+        raw=raw,
+        additional_kwargs=get_addtional_kwargs(raw, ("response",)),
+    )
+
+
+class AsyncOllama(Ollama):
+    """
+    Ollama LLM with non-blocking async methods and pooled connections.
+
+    The async methods llama_index provides for Ollama iterate the synchronous
+    ones, which blocks the event loop for the whole generation, and every
+    call opens a new connection. Here all calls go through shared keep-alive
+    httpx clients, and keep_alive tells Ollama how long to keep the model
+    loaded after a request (e.g. "30m", -1 for ever, None for the server
+    default).
+    """
+
+    keep_alive: Optional[Union[str, int]] = Field(
+        default=None,
+        description="How long Ollama keeps the model loaded after a request.",
+    )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "AsyncOllama_llm"
+
+    def _with_keep_alive(self, payload):
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        return payload
+
+    def _chat_payload(self, messages: Sequence[ChatMessage], stream: bool, **kwargs: Any):
+        return self._with_keep_alive({
+            "model": self.model,
+            "messages": [
+                {
+                    "role": message.role,
+                    "content": message.content,
+                    **message.additional_kwargs,
+                }
+                for message in messages
+            ],
+            "options": self._model_kwargs,
+            "stream": stream,
+            **kwargs,
+        })
+
+    def _completion_payload(self, prompt: str, stream: bool, **kwargs: Any):
+        return self._with_keep_alive({
+            self.prompt_key: prompt,
+            "model": self.model,
+            "options": self._model_kwargs,
+            "stream": stream,
+            **kwargs,
+        })
+
+    def load_model(self):
+        """
+        Have Ollama load the model now rather than on the first question.
+
+        The options of regular requests are sent along, since Ollama reloads
+        the model when a request asks for another context size.
+        """
+        response = get_http_client().post(url=f"{self.base_url}/api/generate",
+                                          json=self._with_keep_alive({"model": self.model,
+                                                                      "options": self._model_kwargs}),
+                                          timeout=Timeout(self.request_timeout))
+        response.raise_for_status()
+
+    def unload_model(self):
+        """Have Ollama release the memory held by the model."""
+        response = get_http_client().post(url=f"{self.base_url}/api/generate",
+                                          json={"model": self.model, "keep_alive": 0},
+                                          timeout=Timeout(self.request_timeout))
+        response.raise_for_status()
+
+    @llm_chat_callback()
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        response = get_http_client().post(url=f"{self.base_url}/api/chat",
+                                          json=self._chat_payload(messages, stream=False, **kwargs),
+                                          timeout=Timeout(self.request_timeout))
+        response.raise_for_status()
+        raw = response.json()
+        return _chat_response(raw, raw["message"], raw["message"].get("content"))
+
+    @llm_chat_callback()
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseGen:
+        payload = self._chat_payload(messages, stream=True, **kwargs)
+        with get_http_client().stream(method="POST", url=f"{self.base_url}/api/chat", json=payload,
+                                      timeout=Timeout(self.request_timeout)) as response:
+            response.raise_for_status()
+            text = ""
+            for line in response.iter_lines():
+                if line:
+                    chunk = json.loads(line)
+                    message = chunk["message"]
+                    delta = message.get("content")
+                    text += delta
+                    yield _chat_response(chunk, message, text, delta)
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        response = get_http_client().post(url=f"{self.base_url}/api/generate",
+                                          json=self._completion_payload(prompt, stream=False, **kwargs),
+                                          timeout=Timeout(self.request_timeout))
+        response.raise_for_status()
+        raw = response.json()
+        return _completion_response(raw, raw.get("response"))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        payload = self._completion_payload(prompt, stream=True, **kwargs)
+        with get_http_client().stream(method="POST", url=f"{self.base_url}/api/generate", json=payload,
+                                      timeout=Timeout(self.request_timeout)) as response:
+            response.raise_for_status()
+            text = ""
+            for line in response.iter_lines():
+                if line:
+                    chunk = json.loads(line)
+                    delta = chunk.get("response")
+                    text += delta
+                    yield _completion_response(chunk, text, delta)
+
+    @llm_chat_callback()
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        response = await get_async_http_client().post(url=f"{self.base_url}/api/chat",
+                                                      json=self._chat_payload(messages, stream=False, **kwargs),
+                                                      timeout=Timeout(self.request_timeout))
+        response.raise_for_status()
+        raw = response.json()
+        return _chat_response(raw, raw["message"], raw["message"].get("content"))
+
+    @llm_chat_callback()
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseAsyncGen:
+        payload = self._chat_payload(messages, stream=True, **kwargs)
+
+        async def gen() -> ChatResponseAsyncGen:
+            async with get_async_http_client().stream(method="POST", url=f"{self.base_url}/api/chat",
+                                                      json=payload,
+                                                      timeout=Timeout(self.request_timeout)) as response:
+                response.raise_for_status()
+                text = ""
+                async for line in response.aiter_lines():
+                    if line:
+                        chunk = json.loads(line)
+                        message = chunk["message"]
+                        delta = message.get("content")
+                        text += delta
+                        yield _chat_response(chunk, message, text, delta)
+
+        return gen()
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        response = await get_async_http_client().post(url=f"{self.base_url}/api/generate",
+                                                      json=self._completion_payload(prompt, stream=False, **kwargs),
+                                                      timeout=Timeout(self.request_timeout))
+        response.raise_for_status()
+        raw = response.json()
+        return _completion_response(raw, raw.get("response"))
+
+    @llm_completion_callback()
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseAsyncGen:
+        payload = self._completion_payload(prompt, stream=True, **kwargs)
+
+        async def gen() -> CompletionResponseAsyncGen:
+            async with get_async_http_client().stream(method="POST", url=f"{self.base_url}/api/generate",
+                                                      json=payload,
+                                                      timeout=Timeout(self.request_timeout)) as response:
+                response.raise_for_status()
+                text = ""
+                async for line in response.aiter_lines():
+                    if line:
+                        chunk = json.loads(line)
+                        delta = chunk.get("response")
+                        text += delta
+                        yield _completion_response(chunk, text, delta)
+
+        return gen()
+
+
+class OllamaConversation:
+    """
+    Token context Ollama returned for the previous turns of a conversation.
+
+    Sending it back with the next completion request makes the previous turns
+    the prompt prefix, which Ollama already holds in its KV cache, so only the
+    new prompt is evaluated. Once the context exceeds max_tokens the
+    conversation starts over, before Ollama would have to truncate it. The
+    contexts before the last max_rewinds turns are kept, so that undone or
+    retried turns can be taken back.
+    """
+
+    def __init__(self, max_tokens, max_rewinds=8):
+        self.max_tokens = max_tokens
+        self.max_rewinds = max_rewinds
+        self.context = None
+        # context before each of the last recorded turns, oldest first
+        self._previous = []
+
+    def context_size(self):
+        return 0 if self.context is None else len(self.context)
+
+    def start_over(self):
+        """Forget the previous turns, e.g. when they leave too little room for the next one."""
+        self.context = None
+
+    def completion_kwargs(self):
+        return {} if self.context is None else {"context": self.context}
+
+    def record(self, raw):
+        context = (raw or {}).get("context")
+        if context is not None:
+            self._previous.append(self.context)
+            del self._previous[:-self.max_rewinds]
+            self.context = context if len(context) <= self.max_tokens else None
+
+    def rewind(self):
+        """Take back the last recorded turn, starting over once no earlier context is kept."""
+        self.context = self._previous.pop() if len(self._previous) > 0 else None
+
+    def deltas(self, responses: CompletionResponseGen):
+        """Yield the deltas of a streamed completion and record its context."""
+        response = None
+        for response in responses:
+            yield response.delta
+        if response is not None:
+            self.record(response.raw)
+
+    async def adeltas(self, responses: CompletionResponseAsyncGen):
+        response = None
+        async for response in responses:
+            yield response.delta
+        if response is not None:
+            self.record(response.raw)
@@ -0,0 +1,72 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+import hashlib
+import threading
+from collections import OrderedDict
+
+from sentence_transformers import CrossEncoder
+
+
+class CrossEncoderReranker:
+    """
+    Scores (query, chunk) pairs with a small local cross-encoder.
+
+    The pairs of a query that are not cached are scored in a single batched
+    forward pass. Scores are cached by query and chunk text hash, keeping the
+    cache_size most recently used ones, so repeated and similar questions
+    retrieving the same chunks are not scored again.
+    """
+
+    def __init__(self, model_name="cross-encoder/ms-marco-MiniLM-L-6-v2", cache_size=4096, max_length=512,
+                 device=None):
+        self.model = CrossEncoder(model_name, max_length=max_length, device=device)
+        self.model_name = model_name
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        # (query, text hash) -> score, least recently used first
+        self._scores = OrderedDict()
+
+    @staticmethod
+    def _key(query, text):
+        return query, hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def score(self, query, texts):
+        """
+        Returns:
+            the relevance score of each text for query, higher is better.
+        """
+        keys = [self._key(query, text) for text in texts]
+        scores = {}
+        with self._lock:
+            for key in keys:
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    scores[key] = self._scores[key]
+        missing = {key: text for key, text in zip(keys, texts) if key not in scores}
+        if len(missing) > 0:
+            predicted = self.model.predict([(query, text) for text in missing.values()],
+                                           batch_size=len(missing), show_progress_bar=False)
+            with self._lock:
+                for key, value in zip(missing, predicted):
+                    scores[key] = self._scores[key] = float(value)
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+        return [scores[key] for key in keys]
@@ -0,0 +1,125 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Optional
+
+from llama_index.storage.docstore.keyval_docstore import KVDocumentStore
+from llama_index.storage.index_store.keyval_index_store import KVIndexStore
+from llama_index.storage.kvstore.types import BaseKVStore, DEFAULT_COLLECTION
+
+SQLITE_STORE_FILE_NAME = "docstore.sqlite"
+
+
+class SQLiteKVStore(BaseKVStore):
+    """
+    llama_index key-value store kept in a single SQLite file.
+
+    Values are only read when asked for, so loading an index does not parse
+    the text of every node. Writes accumulate in one transaction that is
+    committed by persist().
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " collection TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " PRIMARY KEY (collection, key)) WITHOUT ROWID"
+        )
+        self._connection.commit()
+
+    def put(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO kv (collection, key, value) VALUES (?, ?, ?)",
+                                     (collection, key, json.dumps(val)))
+
+    def get(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM kv WHERE collection = ? AND key = ?",
+                                           (collection, key)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def get_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        with self._lock:
+            rows = self._connection.execute("SELECT key, value FROM kv WHERE collection = ?",
+                                            (collection,)).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def delete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        with self._lock:
+            cursor = self._connection.execute("DELETE FROM kv WHERE collection = ? AND key = ?",
+                                              (collection, key))
+        return cursor.rowcount > 0
+
+    def import_json(self, json_path):
+        """Copy the content of a SimpleKVStore JSON file ({collection: {key: value}})."""
+        with open(json_path, 'r') as file:
+            data = json.load(file)
+        with self._lock:
+            for collection, values in data.items():
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO kv (collection, key, value) VALUES (?, ?, ?)",
+                    [(collection, key, json.dumps(value)) for key, value in values.items()])
+
+    def persist(self, db_path=None):
+        with self._lock:
+            self._connection.commit()
+            if db_path is not None and os.path.abspath(db_path) != os.path.abspath(self.db_path):
+                # persisting somewhere else, e.g. a staging directory
+                os.makedirs(os.path.dirname(db_path), exist_ok=True)
+                target = sqlite3.connect(db_path)
+                try:
+                    self._connection.backup(target)
+                finally:
+                    target.close()
+
+    def reopen(self, db_path):
+        """Reconnect after the database file was moved to db_path."""
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+            self.db_path = db_path
+            self._connection = sqlite3.connect(db_path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+
+    def close(self):
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+
+class SQLiteDocumentStore(KVDocumentStore):
+    def persist(self, persist_path=None, fs=None):
+        db_path = os.path.join(os.path.dirname(persist_path), SQLITE_STORE_FILE_NAME) if persist_path else None
+        self._kvstore.persist(db_path)
+
+
+class SQLiteIndexStore(KVIndexStore):
+    def persist(self, persist_path=None, fs=None):
+        db_path = os.path.join(os.path.dirname(persist_path), SQLITE_STORE_FILE_NAME) if persist_path else None
+        self._kvstore.persist(db_path)
@@ -0,0 +1,157 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+import asyncio
+import queue
+import threading
+import time
+
+_END = object()
+
+
+class StreamCoalescer:
+    """
+    Groups streamed text deltas into a bounded number of UI updates.
+
+    Accumulated text is emitted when interval_ms has elapsed since the last
+    update or when max_chars characters are pending, whichever comes first.
+    Pending text is also emitted when the interval expires while waiting for
+    the next delta, so a stalled stream does not hold back its last words.
+    The first delta is emitted right away, so slow models still feel live,
+    and fast models are not throttled. A value of 0 disables the
+    corresponding limit; with both at 0 every delta is emitted.
+    """
+
+    def __init__(self, interval_ms=50, max_chars=0):
+        self.interval = interval_ms / 1000
+        self.max_chars = max_chars
+
+    def _is_due(self, pending_chars, now, last_update):
+        return last_update is None \
+            or (self.interval <= 0 and self.max_chars <= 0) \
+            or (self.interval > 0 and now - last_update >= self.interval) \
+            or (self.max_chars > 0 and pending_chars >= self.max_chars)
+
+    def _timeout(self, pending, last_update):
+        # how long to wait for the next delta before emitting the pending text
+        if not pending or self.interval <= 0:
+            return None
+        return max(0.0, last_update + self.interval - time.monotonic())
+
+    def coalesce(self, deltas, prefix=""):
+        """
+        Yields:
+            the full text so far (prefix included) at each update.
+        """
+        # deltas are read by a thread, so that the interval can expire while one is awaited
+        received = queue.Queue()
+        stopped = threading.Event()
+
+        def read():
+            try:
+                for delta in deltas:
+                    if stopped.is_set():
+                        break
+                    received.put(delta)
+            except Exception as e:
+                received.put(e)
+            finally:
+                received.put(_END)
+
+        threading.Thread(target=read, daemon=True).start()
+        text = prefix
+        pending = []
+        pending_chars = 0
+        last_update = None
+        try:
+            while True:
+                try:
+                    delta = received.get(timeout=self._timeout(pending, last_update))
+                except queue.Empty:
+                    text += "".join(pending)
+                    pending = []
+                    pending_chars = 0
+                    last_update = time.monotonic()
+                    yield text
+                    continue
+                if delta is _END:
+                    break
+                if isinstance(delta, Exception):
+                    raise delta
+                if not delta:
+                    continue
+                pending.append(delta)
+                pending_chars += len(delta)
+                now = time.monotonic()
+                if self._is_due(pending_chars, now, last_update):
+                    text += "".join(pending)
+                    pending = []
+                    pending_chars = 0
+                    last_update = now
+                    yield text
+        finally:
+            # stops reading the stream when the consumer goes away
+            stopped.set()
+        if pending:
+            yield text + "".join(pending)
+
+    async def acoalesce(self, deltas, prefix=""):
+        """Same as coalesce() for an async iterable of deltas."""
+        iterator = deltas.__aiter__()
+        next_delta = None
+        text = prefix
+        pending = []
+        pending_chars = 0
+        last_update = None
+        try:
+            while True:
+                if next_delta is None:
+                    next_delta = asyncio.ensure_future(iterator.__anext__())
+                # the awaited delta is not cancelled when the interval expires
+                done, _ = await asyncio.wait({next_delta}, timeout=self._timeout(pending, last_update))
+                if not done:
+                    text += "".join(pending)
+                    pending = []
+                    pending_chars = 0
+                    last_update = time.monotonic()
+                    yield text
+                    continue
+                try:
+                    delta = next_delta.result()
+                except StopAsyncIteration:
+                    next_delta = None
+                    break
+                next_delta = None
+                if not delta:
+                    continue
+                pending.append(delta)
+                pending_chars += len(delta)
+                now = time.monotonic()
+                if self._is_due(pending_chars, now, last_update):
+                    text += "".join(pending)
+                    pending = []
+                    pending_chars = 0
+                    last_update = now
+                    yield text
+        finally:
+            if next_delta is not None:
+                next_delta.cancel()
+        if pending:
+            yield text + "".join(pending)
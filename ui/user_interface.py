@@ -32,7 +32,53 @@ import threading
 import webbrowser
 import socket
 import random
-            
+import json
+import inspect
+import time
+import asyncio
+
+
+async def _iterate_in_thread(iterator):
+    # runs each step of a blocking generator in a worker thread
+    iterator = iter(iterator)
+    done = object()
+    while True:
+        item = await asyncio.to_thread(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+class _StreamDeltaOutput:
+    """
+    Outputs of a streamed answer for the chatbot and its delta textbox.
+
+    The full history is only sent when the message starts or its text is
+    rewritten, and once more at the end so that the chatbot value stays in
+    sync. Otherwise only the text appended to the message is sent.
+    """
+
+    def __init__(self, history, state):
+        self.history = history
+        self.state = state
+        self._sent_response = None
+        self._seq = 0
+
+    def update(self, response):
+        self.history[-1][1] = response
+        sent_response = self._sent_response
+        self._sent_response = response
+        if sent_response is not None and response.startswith(sent_response):
+            if len(response) == len(sent_response):
+                return None
+            self._seq += 1
+            delta = json.dumps({"seq": self._seq, "delta": response[len(sent_response):]})
+            return gr.update(), delta, self.state
+        return self.history, "", self.state
+
+    def final(self):
+        return self.history, "", self.state
+
 
 class MainInterface:
 
@@ -44,12 +90,17 @@ class MainInterface:
     _shutdown_callback = None
     _reset_chat_callback = None
     _undo_last_chat_callback = None
+    _retry_chat_callback = None
     _model_change_callback = None
     _regenerate_index_callback = None
+    _index_status_callback = None
+    _dataset_index_status_markdown = None
     _query_handler = None
     _state = None
     _interface = None
     _streaming = False
+    _stream_deltas = False
+    _concurrency_limit = 1
     _models_list = {}
 
     def _get_enable_disable_elemet_list(self):
@@ -108,10 +159,15 @@ class MainInterface:
 
         return ret_val
     
-    def __init__(self, chatbot=None, streaming = False) -> None:
+    def __init__(self, chatbot=None, streaming = False, stream_deltas = False, concurrency_limit = 1) -> None:
         self._interface = None
         self._query_handler = chatbot
         self._streaming = streaming
+        # push only the new text of streamed answers instead of the whole history
+        self._stream_deltas = streaming and stream_deltas
+        # chatbot may be an async generator function, in which case this many
+        # answers are generated concurrently on the event loop
+        self._concurrency_limit = concurrency_limit
         self.config = Configuration()
         self._dataset_path = self._get_dataset_path()
         self._default_dataset_path = self._get_default_dataset_path()
@@ -152,12 +208,20 @@ class MainInterface:
     def on_undo_last_chat(self, callback):
         self._undo_last_chat_callback = callback
 
+    def on_retry_chat(self, callback):
+        self._retry_chat_callback = callback
+
     def on_model_change(self, callback):
         self._model_change_callback = callback
 
     def on_regenerate_index(self, callback):
         self._regenerate_index_callback = callback
 
+    def on_index_status(self, callback):
+        # callback returns the progress message of background index builds and
+        # whether a build is still running
+        self._index_status_callback = callback
+
     def _get_theme(self):
         primary_hue = gr.themes.Color("#76B900", "#76B900", "#76B900", "#76B900", "#76B900", "#76B900", "#76B900", "#76B900", "#76B900", "#76B900", "#76B900")
         neutral_hue = gr.themes.Color("#292929", "#292929", "#292929", "#292929", "#292929", "#292929", "#292929", "#292929", "#292929", "#292929", "#292929")
@@ -237,7 +301,8 @@ class MainInterface:
                 self._chat_undo_button,
                 self._chat_reset_button,
                 self._chat_query_group,
-                self._chat_disclaimer_markdown
+                self._chat_disclaimer_markdown,
+                self._chat_stream_delta_textbox
             ) = self._render_chatbot(show_chatbot=len(self._sample_question_components) == 0)
             self._handle_events()
         interface.queue()
@@ -427,14 +492,21 @@ class MainInterface:
                         visible=self._dataset_selected_source=="directory",
                         scale=0
                     )
-                    return (
-                        dataset_source_textbox,
-                        dataset_update_source_edit_button,
-                        dataset_source_dropdown,
-                        regenerate_vector_button,
-                        dataset_label_markdown,
-                        dataset_group
+                if self._index_status_callback:
+                    # refreshed by _follow_index_status while indexes are built in the background
+                    self._dataset_index_status_markdown = gr.Markdown(
+                        lambda: self._index_status_callback()[0],
+                        elem_classes="description-secondary-markdown",
+                        elem_id="dataset-index-status"
                     )
+                return (
+                    dataset_source_textbox,
+                    dataset_update_source_edit_button,
+                    dataset_source_dropdown,
+                    regenerate_vector_button,
+                    dataset_label_markdown,
+                    dataset_group
+                )
 
 
     def _render_sample_question(self):
@@ -514,7 +586,16 @@ class MainInterface:
             "Chat with RTX response quality depends on the AI model's accuracy and the input dataset. Please verify important information.",
             elem_classes="description-secondary-markdown chat-disclaimer-message margin-"
         )
-        return (chatbot_window, query_input, submit_button, retry_button, undo_button, reset_button, query_group, chat_disclaimer_markdown)
+        stream_delta_textbox = None
+        if self._stream_deltas:
+            # carries the text appended to the streamed message, see ui/www/app.js
+            stream_delta_textbox = gr.Textbox(
+                "",
+                container=False,
+                interactive=False,
+                elem_classes="chat-stream-delta-textbox"
+            )
+        return (chatbot_window, query_input, submit_button, retry_button, undo_button, reset_button, query_group, chat_disclaimer_markdown, stream_delta_textbox)
 
     def _handle_events(self):
         self._handle_load_events()
@@ -580,7 +661,7 @@ class MainInterface:
         ] + self._get_sample_question_components()
 
     def _handle_load_events(self):
-        self._interface.load(
+        load_event = self._interface.load(
             self._validate_session,
             None,
             self._get_validate_session_output()
@@ -593,8 +674,31 @@ class MainInterface:
             self._get_show_hide_sample_questions_inputs(),
             self._get_show_hide_sample_questions_outputs()
         )
+        # e.g. the index of the dataset loaded at startup
+        self._follow_index_status(load_event)
         return None
 
+    def _index_status_updates(self):
+        # polls the status only while a build is running
+        while True:
+            message, building = self._index_status_callback()
+            yield message
+            if not building:
+                return
+            time.sleep(1)
+
+    def _follow_index_status(self, event):
+        """Refresh the index status after event, until the build it may have started is done."""
+        if self._dataset_index_status_markdown is None:
+            return
+        event.then(
+            self._index_status_updates,
+            None,
+            self._dataset_index_status_markdown,
+            show_progress=False,
+            concurrency_limit=None
+        )
+
     def _handle_shutdown_events(self):
         def close_thread(session_id):
             if self._shutdown_callback:
@@ -727,7 +831,7 @@ class MainInterface:
                 )
             return self._dataset_path, state
         
-        self._dataset_update_source_edit_button.click(
+        dataset_event = self._dataset_update_source_edit_button.click(
             self._validate_session,
             None,
             self._get_validate_session_output()
@@ -754,6 +858,7 @@ class MainInterface:
             self._get_show_hide_sample_questions_outputs(),
             show_progress=False
         )
+        self._follow_index_status(dataset_event)
 
         def on_dataset_source_changed(source, state, request: gr.Request):
             self._validate_session(request)
@@ -790,7 +895,7 @@ class MainInterface:
             }
         """
 
-        self._dataset_source_dropdown.change(
+        dataset_event = self._dataset_source_dropdown.change(
             self._validate_session,
             None,
             self._get_validate_session_output()
@@ -830,6 +935,7 @@ class MainInterface:
             self._get_show_hide_sample_questions_outputs(),
             show_progress=False
         )
+        self._follow_index_status(dataset_event)
 
         def regenerate_index(state, request: gr.Request):
             self._validate_session(request)
@@ -837,7 +943,7 @@ class MainInterface:
                 self._regenerate_index_callback(self._dataset_selected_source, self._dataset_path, self._get_session_id(state))
             return self._dataset_path, state
 
-        self._dataset_regenerate_index_button.click(
+        dataset_event = self._dataset_regenerate_index_button.click(
             self._validate_session,
             None,
             self._get_validate_session_output()
@@ -859,6 +965,7 @@ class MainInterface:
             self._get_enable_disable_elemet_list(),
             show_progress=False
         )
+        self._follow_index_status(dataset_event)
 
 
 # dataset events ends
@@ -916,21 +1023,59 @@ class MainInterface:
             history.append([query, None])
             return "", history
         
-        def process_output(history, state, request: gr.Request):
+        is_async_handler = inspect.isasyncgenfunction(self._query_handler)
+
+        def query_responses(history, state):
+            query = history[-1]
+            responses = self._query_handler(query[0], history[:-1], self._get_session_id(state))
+            # a blocking handler is stepped in a worker thread, off the event loop
+            return responses if is_async_handler else _iterate_in_thread(responses)
+
+        async def process_output(history, state, request: gr.Request):
             self._validate_session(request)
-            if len(history) == 0:
+            if len(history) == 0 or history[-1][1] != None:
                 yield history, state
-            else:
-                query = history[-1]
-                if query[1] != None:
-                    yield history, state
-                elif self._query_handler:
-                    for response in self._query_handler(query[0], history[:-1], self._get_session_id(state)):
-                        history[-1][1] = response
-                        yield history, state
-                else:
-                    history[-1][1] = "ChatBot not ready..."
+            elif self._query_handler:
+                async for response in query_responses(history, state):
+                    history[-1][1] = response
                     yield history, state
+            else:
+                history[-1][1] = "ChatBot not ready..."
+                yield history, state
+
+        async def process_output_deltas(history, state, request: gr.Request):
+            if len(history) == 0 or history[-1][1] != None or not self._query_handler:
+                async for history, state in process_output(history, state, request):
+                    yield history, "", state
+                return
+            self._validate_session(request)
+            output = _StreamDeltaOutput(history, state)
+            async for response in query_responses(history, state):
+                update = output.update(response)
+                if update is not None:
+                    yield update
+            yield output.final()
+
+        if self._chat_stream_delta_textbox is not None:
+            output_handler = process_output_deltas
+            output_components = [self._chat_bot_window, self._chat_stream_delta_textbox, self._state]
+            self._chat_stream_delta_textbox.change(
+                None,
+                self._chat_stream_delta_textbox,
+                None,
+                show_progress=False,
+                js="(delta) => { window.appendChatStreamDelta(delta); return []; }"
+            )
+            self._chat_bot_window.change(
+                None,
+                None,
+                None,
+                show_progress=False,
+                js="() => { window.clearChatStreamDeltas(); return []; }"
+            )
+        else:
+            output_handler = process_output
+            output_components = [self._chat_bot_window, self._state]
             
         #undo handler
         def process_undo_last_chat(history: list, state, request: gr.Request):
@@ -945,13 +1090,15 @@ class MainInterface:
             return history, state
 
         #retry handler
-        def process_retry(history: list, request: gr.Request):
+        def process_retry(history: list, state, request: gr.Request):
             self._validate_session(request)
             if len(history) == 0:
                 return history
 
             lastChat = history[-1]
             history = history[:len(history) - 1]
+            if self._retry_chat_callback:
+                self._retry_chat_callback(history, self._get_session_id(state))
             _, history = process_input(lastChat[0], history, request)
             return history
 
@@ -979,9 +1126,11 @@ class MainInterface:
             [self._chat_query_input_textbox, self._chat_bot_window], 
             [self._chat_query_input_textbox, self._chat_bot_window]
         ).then(
-            process_output,
+            output_handler,
             [self._chat_bot_window, self._state],
-            [self._chat_bot_window, self._state]
+            output_components,
+            concurrency_limit=self._concurrency_limit,
+            concurrency_id="chat-answer"
         )
 
         self._chat_retry_button.click(
@@ -994,12 +1143,14 @@ class MainInterface:
             None
         ).success(
             process_retry,
-            [self._chat_bot_window],
+            [self._chat_bot_window, self._state],
             [self._chat_bot_window]
         ).then(
-            process_output,
+            output_handler,
             [self._chat_bot_window, self._state],
-            [self._chat_bot_window, self._state]
+            output_components,
+            concurrency_limit=self._concurrency_limit,
+            concurrency_id="chat-answer"
         )
 
         if self._chat_undo_button:
@@ -1057,7 +1208,9 @@ class MainInterface:
                 [self._chat_query_input_textbox, self._chat_bot_window], 
                 [self._chat_query_input_textbox, self._chat_bot_window]
             ).then(
-                process_output,
+                output_handler,
                 [self._chat_bot_window, self._state],
-                [self._chat_bot_window, self._state]
+                output_components,
+                concurrency_limit=self._concurrency_limit,
+                concurrency_id="chat-answer"
             )
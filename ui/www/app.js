@@ -78,6 +78,43 @@
         }
     });
 
+    // streamed answers: after the first update of a message the backend only
+    // sends the text appended to it, as {"seq": n, "delta": text}. It is added
+    // to the rendered message until the final full update replaces it.
+    window.appendChatStreamDelta = function (payload) {
+        if(!payload) {
+            return;
+        }
+        const update = JSON.parse(payload);
+        const messages = document.querySelectorAll('#main-chatbot-window button[data-testid="bot"]');
+        if(messages.length === 0) {
+            return;
+        }
+        const message = messages[messages.length - 1];
+        let target = message.querySelector('.md') || message;
+        if(target.lastElementChild && target.lastElementChild.tagName === 'P') {
+            target = target.lastElementChild;
+        }
+        let pending = target.querySelector(':scope > .chat-stream-delta');
+        if(!pending) {
+            pending = document.createElement('span');
+            pending.classList.add('chat-stream-delta');
+            target.appendChild(pending);
+        }
+        const log = message.closest('[role="log"]');
+        const autoscroll = log && log.offsetHeight + log.scrollTop > log.scrollHeight - 100;
+        pending.insertAdjacentText('beforeend', update.delta);
+        if(autoscroll) {
+            log.scrollTop = log.scrollHeight;
+        }
+    };
+
+    window.clearChatStreamDeltas = function () {
+        document.querySelectorAll('#main-chatbot-window .chat-stream-delta').forEach(function (element) {
+            element.remove();
+        });
+    };
+
     // Function to get tooltip content based on the element's ID
     function getTooltipContent(elementId) {
         // Example logic, you can customize it based on your needs